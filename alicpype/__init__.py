@@ -1 +1 @@
-from . import tasks, externalio, tractography
\ No newline at end of file
+from . import tasks, externalio, tractography, batch
\ No newline at end of file
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# description: run the subject-specific pipeline for a batch of subjects with a pool of worker processes
+
+import os
+import sys
+import resource
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait
+from pathlib import Path
+from contextlib import contextmanager
+from traceback import print_exc
+import numpy as np
+
+from . import config
+from .containers import preflight
+
+# environment variables read by the external tools (MRtrix, ANTs, FSL) and by numpy/BLAS to pick their thread count.
+# BLAS reads them once when numpy is imported, so they are set before the worker processes are spawned
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+    'MRTRIX_NTHREADS', 'ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS']
+
+def parse_args(description):
+    """
+    This function interprets terminal input for the main_batch_*.py scripts and returns corresponding python variables.
+    :description:   description of the calling batch script
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        'subject_list',
+        help='CSV-format file containing the subject IDs to run, one subject ID per line.')
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=config.batch_workers,
+        help='number of subjects processed concurrently. Default %(default)s.')
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=config.batch_threads_per_worker,
+        help='number of threads numpy/BLAS and each external tool may use within a worker. Default %(default)s.')
+    parser.add_argument(
+        '--memory-gb',
+        type=float,
+        default=config.batch_memory_gb,
+        help='address space limit (GB) of each worker and its child processes. Default is no limit.')
+    parser.add_argument(
+        '--log-dir',
+        default=None,
+        help='directory where per-subject logs are written. Default is <alicpype_root>/%s.' % config.batch_log_dir)
+    return parser.parse_args()
+
+def load_subject_list(subject_list_file):
+    """
+    This function loads a CSV-formatted list of subjects, with one subject ID per line.
+    :subject_list_file:     path to csv containing list of subjects
+    """
+    subject_list_file = Path(subject_list_file).expanduser().resolve()
+    return np.atleast_1d(np.loadtxt(subject_list_file, delimiter=',', dtype=str))
+
+# cap the threads of the worker processes started within the context
+@contextmanager
+def limit_threads(threads=None):
+    """
+    This function sets the thread count variables of the environment for the duration of the context. Worker
+    processes spawned within the context start a fresh interpreter, so the limit applies to numpy/BLAS in the worker
+    as well as to the subprocesses (tractography, MRtrix, FSL, ANTs, Slicer) it launches.
+    :threads:       number of threads per worker and external tool (None leaves the environment untouched)
+    """
+    saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    if threads is not None:
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = str(threads)
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+# cap the memory used by the current worker process and everything it launches
+def limit_resources(memory_gb=None):
+    """
+    This function caps the memory available to the current process, the limit is inherited by its subprocesses.
+    :memory_gb:     address space limit in GB (None for no limit)
+    """
+    if memory_gb is not None:
+        limit = int(memory_gb * 1024**3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+# send everything written to stdout/stderr (including subprocesses) to a log file
+@contextmanager
+def redirect_output(log_file):
+    """
+    This function redirects the stdout and stderr file descriptors of the current process to a log file.
+    :log_file:      path to log file, overwritten if it already exists
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    with open(log_file, 'w') as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+
+def run_subject_worker(task, subject, input_root, alicpype_root, log_dir, memory_gb=None):
+    """
+    This function runs a single subject within a worker process and logs its output to its own file.
+    :task:              alicpype.tasks function to run (ex. run_hcp_subject)
+    :subject:           subject ID
+    :input_root:        path to dataset where data will be copied from
+    :alicpype_root:     path to processed dataset from ALIC_tractography pipeline
+    :log_dir:           directory where the subject log is written
+    :memory_gb:         address space limit in GB of the worker (None for no limit)
+
+    :return: (subject, True if the subject finished without error)
+    """
+    limit_resources(memory_gb)
+    log_file = Path(log_dir) / f'{subject}.log'
+    with redirect_output(log_file):
+        print(f'starting processing for subject {subject}')
+        #skip subject if error out
+        try:
+            task(subject, input_root, alicpype_root)
+        except Exception as e:
+            print(f'encountered an error when running {subject}')
+            print_exc()
+            return subject, False
+    return subject, True
+
+def _subject_process(*args):
+    """
+    This function is the entry point of the process running a single subject, its exit code reports the outcome.
+    """
+    _, success = run_subject_worker(*args)
+    sys.exit(0 if success else 1)
+
+def run_batch(task, subject_list, input_root, alicpype_root, n_workers=None, threads=None, memory_gb=None,
+        log_dir=None):
+    """
+    This function runs a task on every subject in a list, each subject in its own worker process with at most
+    n_workers running at a time. A subject that errors out, or whose worker dies (ex. killed for exceeding memory),
+    is reported and skipped, the remaining subjects keep running.
+    :task:              alicpype.tasks function to run (ex. run_hcp_subject)
+    :subject_list:      list of subjects
+    :input_root:        path to dataset where data will be copied from
+    :alicpype_root:     path to processed dataset from ALIC_tractography pipeline
+    :n_workers:         number of subjects processed concurrently, default config.batch_workers
+    :threads:           number of threads of numpy/BLAS and of each external tool within each worker, default
+                        config.batch_threads_per_worker
+    :memory_gb:         address space limit in GB of each worker, default config.batch_memory_gb (None for no limit)
+    :log_dir:           directory for per-subject logs (default <alicpype_root>/logs)
+
+    :return: list of subjects that encountered an error
+    """
+    n_workers = config.batch_workers if n_workers is None else n_workers
+    threads = config.batch_threads_per_worker if threads is None else threads
+    memory_gb = config.batch_memory_gb if memory_gb is None else memory_gb
+    alicpype_root = Path(alicpype_root)
+    log_dir = alicpype_root / config.batch_log_dir if log_dir is None else Path(log_dir)
+    os.makedirs(log_dir, exist_ok=True)
+
+    # make sure no worker has to pull a container image in the middle of a run
+    if config.use_container_cache:
+        missing = preflight(cache_dir=alicpype_root / config.container_cache_dir, pull=config.container_pull_missing)
+        if missing:
+            raise RuntimeError(f'container images missing from {alicpype_root / config.container_cache_dir}: {missing}')
+
+    # fresh interpreters, so that the thread limits also apply to numpy/BLAS in the workers
+    context = multiprocessing.get_context('spawn')
+    pending = [str(subject_id) for subject_id in subject_list]
+    running = {}
+    failed = []
+    with limit_threads(threads):
+        while pending or running:
+            while pending and len(running) < n_workers:
+                subject_id = pending.pop(0)
+                process = context.Process(target=_subject_process, name=subject_id,
+                    args=(task, subject_id, input_root, alicpype_root, log_dir, memory_gb))
+                process.start()
+                running[process.sentinel] = process
+            for sentinel in wait(list(running)):
+                process = running.pop(sentinel)
+                process.join()
+                subject_id = process.name
+                if process.exitcode == 0:
+                    print(f'finished processing for subject {subject_id}')
+                    continue
+                if process.exitcode < 0:
+                    # the worker itself died, only this subject is lost
+                    print(f'worker running {subject_id} was killed by signal {-process.exitcode}')
+                print(f'encountered an error when running {subject_id}, see {log_dir / (subject_id + ".log")}')
+                failed.append(subject_id)
+
+    print(f'{len(subject_list) - len(failed)} of {len(subject_list)} subjects finished without error')
+    return failed
@@ -9,7 +9,6 @@ import numpy as np
 from warnings import warn
 from pathlib import Path
 import nibabel as nib
-from scipy import ndimage
 from subprocess import run
 
 import pandas as pd
@@ -18,7 +17,7 @@ import wmaPyTools.analysisTools
 import wmaPyTools.segmentationTools
 import wmaPyTools.streamlineTools
 import wmaPyTools.visTools
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryDirectory
 
 # dipy
 from dipy.tracking.utils import reduce_labels
@@ -30,13 +29,19 @@ from dipy.tracking.utils import density_map
 # alicpype imports
 from . import config
 from .config import targetLabels
+from .xfmcache import convert_transform
+from .registration import load_itk_displacement_field, apply_itk_displacement_field
+from .registration import read_itk_affine, transform_streamlines, resample_nearest
+from .streamlineio import save_vtk
+from .heatmap import centerofmass_by_slice
 
 # convert ACPC_to_MNI xfm in fsl format to ANTS
 # function inverts the 2nd axis (AP persumably)
 def convertfslxfm_to_ANTS(acpc_to_mni_xfm_fsl,acpc_to_mni_xfm_ANTS, acpc_ref_image):
     """
     This function converts a transform file FSL format to ANTS.
-    :add_dimensions:            insert extra dimensions to resample ANTS transform
+    The warp is resampled onto the reference grid (nearest neighbour, as AFNI 3dresample) one component at a time
+    into a single float32 X x Y x Z x 1 x 3 array, which is written once.
 
     acpc_to_mni_xfm_fsl:        input tranform in FSL format
     acpc_to_mni_xfm_ANTS:       output transform in ANTS format
@@ -45,38 +50,20 @@ def convertfslxfm_to_ANTS(acpc_to_mni_xfm_fsl,acpc_to_mni_xfm_ANTS, acpc_ref_ima
     """
     if acpc_to_mni_xfm_ANTS.is_file():
         os.remove(acpc_to_mni_xfm_ANTS)
-    cmd = ['3dresample', '-master', str(acpc_ref_image),
-        '-prefix', str(acpc_to_mni_xfm_ANTS),
-        '-input', str(acpc_to_mni_xfm_fsl)]
-    run(cmd, check=True)
-    
-    add_dimensions(acpc_to_mni_xfm_ANTS, acpc_to_mni_xfm_ANTS)
     invert_axis = 1
-    nifti = nib.load(acpc_to_mni_xfm_ANTS)
-    voxels = nifti.get_fdata()
-    voxels[:,:,:,:,invert_axis] = -1 * voxels[:,:,:,:,invert_axis]
+    xfm_fsl = nib.load(acpc_to_mni_xfm_fsl)
+    ref = nib.load(acpc_ref_image)
+    voxels = np.empty(ref.shape[:3] + (1, 3), dtype=np.float32)
+    for i in range(3):
+        component = np.asarray(xfm_fsl.dataobj[..., i], dtype=np.float32)
+        resample_nearest(component, xfm_fsl.affine, ref.affine, ref.shape[:3], out=voxels[:,:,:,0,i])
+        del component
+    voxels[:,:,:,:,invert_axis] *= -1
     xfm_hdr_template = nib.load(config.xfm_header_template).header
-    nifti_out = nib.Nifti1Image(voxels, nifti.affine, header=xfm_hdr_template)
+    nifti_out = nib.Nifti1Image(voxels, ref.affine, header=xfm_hdr_template)
+    nifti_out.set_data_dtype(np.float32)
     nib.save(nifti_out, acpc_to_mni_xfm_ANTS)
 
-# insert extra dimensions (to resample ANTS transform)
-def add_dimensions(nifti_in, nifti_out):
-    """
-    This function inserts an additional dimension to resample the ANTS transform.
-    nifti_in:       input ANTS transform nifti
-    nifti_out:      output resampled ANTS transform nifti
-    """
-    nifti = nib.load(nifti_in)
-    affine = nifti.affine
-    #print(header)
-    voxels = nifti.get_fdata()
-    voxels = np.squeeze(voxels)
-    voxels = np.expand_dims(voxels, 3)
-
-    #print(np.shape(voxels)) # should be (?, ?, ?, 1, 3)
-    nifti_itk = nib.Nifti1Image(voxels, affine)
-    nib.save(nifti_itk, nifti_out)
-
 # transform centroid coordinates from ACPC to MNI space
 def transform_centerofmass_to_mni(input_points, transform_file):
     """
@@ -86,22 +73,45 @@ def transform_centerofmass_to_mni(input_points, transform_file):
 
     :return: transformed output centroid coordinates
     """
-    n_points = np.shape(input_points)[0]
-    if n_points > 0:
-        with NamedTemporaryFile(suffix = '.csv') as input_points_file:
-            with NamedTemporaryFile(suffix = '.csv') as output_points_file:
-                np.savetxt(input_points_file.name, input_points, delimiter=",", header="r,a,s")
-                p = run(
-                    ['Slicer',
-                        '--no-main-window',
-                        '--python-script', str(config.slicer_apply_xfm_script),
-                        '--output', str(output_points_file.name),
-                        '--transform', str(transform_file),
-                        str(input_points_file.name)],
-                    check=True)
-                output_points = np.loadtxt(output_points_file.name, delimiter=",", skiprows=1, ndmin=2)
-                return output_points
-    else: return input_points 
+    return transform_centerofmass_list_to_mni([input_points], transform_file)[0]
+
+# transform several sets of centroid coordinates from ACPC to MNI space within a single Slicer session
+def transform_centerofmass_list_to_mni(input_points_list, transform_file):
+    """
+    This function transforms a list of centroid coordinate arrays from original to transformed space.
+    With config.point_transform_backend == 'slicer', all non-empty arrays are sent through a single Slicer process,
+    which loads the transform once. Otherwise the ITK displacement field is applied in python.
+    :input_points_list:     list of input centroid coordinates (N x 3 arrays)
+    :transform_file:        transform file
+
+    :return: list of transformed output centroid coordinates
+    """
+    output_points_list = list(input_points_list) # empty arrays are returned as they are
+    to_transform = [i for i, input_points in enumerate(input_points_list) if np.shape(input_points)[0] > 0]
+    if len(to_transform) == 0:
+        return output_points_list
+    if config.point_transform_backend == 'native':
+        # Slicer hardens the inverse of the transform read from file
+        xfm = load_itk_displacement_field(transform_file)
+        for i in to_transform:
+            output_points_list[i] = apply_itk_displacement_field(input_points_list[i], xfm, inverse=True)
+        return output_points_list
+    with TemporaryDirectory() as tmp_dir:
+        input_points_files = [Path(tmp_dir) / f'input_points_{i}.csv' for i in to_transform]
+        output_points_files = [Path(tmp_dir) / f'output_points_{i}.csv' for i in to_transform]
+        for i, input_points_file in zip(to_transform, input_points_files):
+            np.savetxt(input_points_file, input_points_list[i], delimiter=",", header="r,a,s")
+        p = run(
+            ['Slicer',
+                '--no-main-window',
+                '--python-script', str(config.slicer_apply_xfm_script),
+                '--transform', str(transform_file),
+                *[str(i) for i in input_points_files],
+                '--output', *[str(i) for i in output_points_files]],
+            check=True)
+        for i, output_points_file in zip(to_transform, output_points_files):
+            output_points_list[i] = np.loadtxt(output_points_file, delimiter=",", skiprows=1, ndmin=2)
+    return output_points_list
 
 
 # transform fiber bundles from ACPC to DTI space
@@ -113,14 +123,25 @@ def transform_bundle_to_dti(input_bundle, transform, output_bundle):
 
     :return: transformed output fiber bundle
     """
+    transform_bundles_to_dti([input_bundle], transform, [output_bundle])
 
+# transform several fiber bundles in a single Slicer session
+def transform_bundles_to_dti(input_bundles, transform, output_bundles):
+    """
+    This function transforms fiber bundles from native space to transformed space within a single Slicer process,
+    which loads the transform once.
+    :input_bundles:     input fiber bundle vtks
+    :transform:         transform file
+    :output_bundles:    transformed output fiber bundle vtks, one per input bundle
+    """
     p = run(
         ['Slicer',
             '--no-main-window',
             '--python-script', str(config.slicer_apply_xfm2bundle_script),
-            '--output', str(output_bundle),
             '--transform', str(transform),
-            str(input_bundle)],
+            *(['--binary'] if config.vtk_binary else []),
+            *[str(i) for i in input_bundles],
+            '--output', *[str(i) for i in output_bundles]],
         check=True)
 
 # transform fiber bundle in vtk format from ACPC to DTI space (transform_bundle_to_dti)
@@ -129,11 +150,22 @@ def transform_bundles(cwd):
     This function transforms fiber bundles from ACPC to DTI space
     cwd:    path to subject-specific processe data directory
     """
+    bundles = []
     for iSide in ['left','right']:
         for iTarget in config.targetLabels[iSide]:
             target = f'combined_aLIC_{iSide}_{iTarget}_{config.freesurfer_lookup_table.loc[iTarget, "LabelName:"]}.vtk'
             output_bundle = f'combined_aLIC_{iSide}_{iTarget}_{config.freesurfer_lookup_table.loc[iTarget, "LabelName:"]}_space-dti.vtk'
-            transform_bundle_to_dti(cwd/config.saveFigDir/target, cwd/config.DTI_to_acpc_xfm, cwd/config.saveFigDir/output_bundle)
+            bundles.append((cwd/config.saveFigDir/target, cwd/config.saveFigDir/output_bundle))
+
+    if config.bundle_transform_backend == 'native':
+        # from-DTI_to-acpc_xfm is linear: apply it to the streamlines of each bundle (saved next to the vtk as tck),
+        # as Slicer does after inverting the transform node
+        affine = read_itk_affine(cwd/config.DTI_to_acpc_xfm)
+        for input_bundle, output_bundle in bundles:
+            streams = nib.streamlines.load(input_bundle.with_suffix('.tck')).streamlines
+            save_vtk(transform_streamlines(streams, affine), output_bundle, binary=config.vtk_binary)
+    else:
+        transform_bundles_to_dti([i for i, _ in bundles], cwd/config.DTI_to_acpc_xfm, [i for _, i in bundles])
 
 # generate coordinates of centroid based on streamline heatmap restricted to within the ALIC
 def generate_centroid(cwd):
@@ -142,8 +174,7 @@ def generate_centroid(cwd):
     cwd:    path to subject-specific processe data directory
     """
     cwd = Path(cwd)
-    ALIC_mask_file = {'left': cwd/ 'app-track_aLIC/output/ROIS/fullCutIC_ROI11_left.nii.gz',
-                    'right': cwd/ 'app-track_aLIC/output/ROIS/fullCutIC_ROI11_right.nii.gz'}
+    ALIC_mask_file = {k: cwd / v for k, v in config.alic_mask_files.items()}
     #STN_mask_file = {'left': cwd/ config.STN_segmentation_left,
                     #'right': cwd/ config.STN_segmentation_right}
 
@@ -151,8 +182,9 @@ def generate_centroid(cwd):
     track_files = {k: [cwd / i for i in v]
         for k, v in config.track_files.items()}
 
-    convertfslxfm_to_ANTS(cwd/config.acpc_to_mni_xfm, cwd/config.acpc_to_mni_xfm_itk, 
-        cwd/config.MNI_ref_image)
+    convert_transform(cwd/config.acpc_to_mni_xfm, cwd/config.acpc_to_mni_xfm_itk, 
+        cwd/config.MNI_ref_image, 'itk', convertfslxfm_to_ANTS)
+    centroids = [] # centroids of all targets, transformed to MNI together
     for iSide in ['left','right']: #iterate over each hemisphere
         # for normal operation, only calculate centroids for the ALIC and skip the stn
         # for imask, imask_label in [[ALIC_mask_file, 'withinALIC'],[STN_mask_file, 'STN']]: #iterate over both ALIC and STN mask
@@ -160,8 +192,14 @@ def generate_centroid(cwd):
         
             mask = nib.load(imask[iSide]) #loading mask 
             for track_file in track_files[iSide]: 
-                for iTarget in targetLabels[iSide]: #iterate over each pathway
-                     generate_centroid_from_mask(cwd, mask, iTarget, track_file, imask_label)
+                # all pathways of a tractogram at once
+                centroids.extend(centerofmass_from_mask_targets(cwd, mask, targetLabels[iSide], track_file, imask_label))
+
+    # transform the centroids of every target from acpc to MNI in a single Slicer session
+    centerofmass_mni_list = transform_centerofmass_list_to_mni(
+        [centerofmass for centerofmass, _, _, _ in centroids], cwd/config.acpc_to_mni_xfm_itk)
+    for (centerofmass, targetStr, out_file, mni_out_file), centerofmass_mni in zip(centroids, centerofmass_mni_list):
+        save_centroids_acpc_mni(centerofmass, centerofmass_mni, targetStr, out_file, mni_out_file)
 
 def generate_centroid_from_mask(cwd, in_mask, iTarget, track_file, mask_label):
     """
@@ -173,33 +211,70 @@ def generate_centroid_from_mask(cwd, in_mask, iTarget, track_file, mask_label):
     mask_label: mask label (ex. ALIC, STN)
     """
     cwd = Path(cwd)
+    centerofmass, targetStr, out_file, mni_out_file = centerofmass_from_mask(cwd, in_mask, iTarget, track_file, mask_label)
+    centerofmass_mni = transform_centerofmass_to_mni(centerofmass, cwd/config.acpc_to_mni_xfm_itk)
+    save_centroids_acpc_mni(centerofmass, centerofmass_mni, targetStr, out_file, mni_out_file)
+
+def centerofmass_from_mask(cwd, in_mask, iTarget, track_file, mask_label):
+    """
+    This function calculates 3D coordinates (in ACPC) of centroids based of density map restricted to within a mask (ie. ALIC, STN).
+    cwd:        path to subject-specific process directory
+    in_mask:    input mask
+    iTarget:    PFC subregion label
+    track_file: PFC subregion track file
+    mask_label: mask label (ex. ALIC, STN)
+
+    return: (centroids in ACPC, target label, ACPC output csv, MNI output csv)
+    """
+    return centerofmass_from_mask_targets(cwd, in_mask, [iTarget], track_file, mask_label)[0]
+
+def centerofmass_from_mask_targets(cwd, in_mask, targets, track_file, mask_label):
+    """
+    This function calculates 3D coordinates (in ACPC) of centroids of the density maps of several targets restricted
+    to within a mask (ie. ALIC, STN). The mask is resampled once for all targets.
+    cwd:        path to subject-specific process directory
+    in_mask:    input mask
+    targets:    PFC subregion labels
+    track_file: PFC subregion track file
+    mask_label: mask label (ex. ALIC, STN)
+
+    return: list of (centroids in ACPC, target label, ACPC output csv, MNI output csv), one per target
+    """
+    cwd = Path(cwd)
     APaxis = 1
         # load Freesurfer labelsfreesurfer_lookup_table
     lookupTable = config.freesurfer_lookup_table
     saveFigDir = cwd / config.saveFigDir
-    targetStr = lookupTable.loc[iTarget, 'LabelName:'] #label corresponding to each pathway
-    in_file = saveFigDir / ('%s_%04d_%s' % (track_file.stem, iTarget, targetStr)) #generate input file
-    in_nifti = nib.load(in_file.with_suffix('.nii.gz')) #load nifti of a pathway
-    in_img = in_nifti.get_fdata() #convert nifti into a voxel array
-    resample_mask = dipy.align.resample(in_mask,in_nifti) #resample ALIC mask nifti into heatmap nifti dimensions
-    in_img = in_img*resample_mask.get_fdata() #multiply ALIC density map voxel array by resampled ALIC mask array
-    num_slices = np.shape(in_img)[APaxis]
-    out_file = saveFigDir / ('%s_%04d_%s_centerofmass_%s' % (track_file.stem, iTarget, targetStr, mask_label)) #output center of mass image in acpc
-    mni_out_file = saveFigDir / ('%s_%04d_%s_centerofmass_%s_mni' % (track_file.stem, iTarget, targetStr, mask_label)) #output centroids in mni space
-    centerofmass = np.zeros([num_slices,3]) #numerical array corresponding to x,y,z coordinates of centroid in acpc
-    
-    for iSlice in range(num_slices): #interating over total number of coronal slides of input image
-        img_slice = in_img[:,iSlice,:] #an individual slice
-        tmp = ndimage.center_of_mass(img_slice, labels=None, index=None) #step that calculates COM for each slice
-        centerofmass[iSlice,:] = [tmp[0],iSlice,tmp[1]] #adding iSlice at APaxis=1
-    centerofmass = centerofmass[~np.any(np.isnan(centerofmass),axis=1)]
-    nib.affines.apply_affine(in_nifti.affine, centerofmass, inplace=True)
-    if centerofmass.size > 0:
+    targetStrs = [lookupTable.loc[iTarget, 'LabelName:'] for iTarget in targets] #label corresponding to each pathway
+    in_files = [saveFigDir / ('%s_%04d_%s' % (track_file.stem, iTarget, targetStr))
+        for iTarget, targetStr in zip(targets, targetStrs)] #generate input files
+    in_niftis = [nib.load(in_file.with_suffix('.nii.gz')) for in_file in in_files] #load nifti of each pathway
+    # all density maps of a tractogram share the same grid
+    resample_mask = dipy.align.resample(in_mask, in_niftis[0]) #resample ALIC mask nifti into heatmap nifti dimensions
+    mask_img = resample_mask.get_fdata()
+
+    results = []
+    for iTarget, targetStr, in_nifti in zip(targets, targetStrs, in_niftis):
+        out_file = saveFigDir / ('%s_%04d_%s_centerofmass_%s' % (track_file.stem, iTarget, targetStr, mask_label)) #output center of mass image in acpc
+        mni_out_file = saveFigDir / ('%s_%04d_%s_centerofmass_%s_mni' % (track_file.stem, iTarget, targetStr, mask_label)) #output centroids in mni space
+        centerofmass = centerofmass_by_slice(in_nifti, mask_img, APaxis) #density map voxel arrays multiplied by resampled ALIC mask array
+        centerofmass = centerofmass[~np.any(np.isnan(centerofmass),axis=1)]
+        nib.affines.apply_affine(in_nifti.affine, centerofmass, inplace=True)
         print(centerofmass.shape)
-        centerofmass_mni = transform_centerofmass_to_mni(centerofmass, 
-            cwd/config.acpc_to_mni_xfm_itk)
-    else: 
-        centerofmass_mni = centerofmass
+        results.append((centerofmass, targetStr, out_file, mni_out_file))
+    return results
+
+# save out centroids in both ACPC and MNI space
+def save_centroids_acpc_mni(centerofmass, centerofmass_mni, targetStr, out_file, mni_out_file):
+    """ 
+    This function saves out slicer-compatible csvs containing centroids in ACPC and MNI space
+    centerofmass:       3D coordinates of centroids in ACPC
+    centerofmass_mni:   3D coordinates of centroids in MNI
+    targetStr:          PFC subregion label
+    out_file:           csv of centroids in ACPC
+    mni_out_file:       csv of centroids in MNI
+    """
+    if centerofmass.size == 0:
         print("csv for this target is empty")
 
     # export centroids in ACPC (3dSlicer compatible)
@@ -19,6 +19,13 @@ sys.path.append(str(ALIC_TRACTOGRAPHY_DIR / 'wma_pyTools'))
 # this is the path used on UMN-CMRR linux computers, on other environments install and configure connectome workbench yourself
 os.environ['PATH'] = '/opt/local/dbs/bin/hcp-workbench-1.4.2/workbench/bin_rh_linux64:'+ os.environ['PATH']
 
+# app-track_aLIC installation: 'clone' gives every subject its own git clone, 'shared' gives every subject a
+# working directory (own indata/output) linking to the single install at alic_app_dir, which must be kept read-only
+alic_app_mode = 'clone'
+alic_app_dir = ALIC_TRACTOGRAPHY_DIR / 'app-track_aLIC'
+# git commit app-track_aLIC must be at (checked out in clone mode, verified in shared mode), None for any version
+alic_app_version = None
+
 # script to transform points/fiducials using Slicer
 slicer_apply_xfm_script = ALICPYPE_DIR / 'slicer_transform_points.py'
 xfm_header_template = ALIC_TRACTOGRAPHY_DIR / 'indata' / 'xfm_header_template.hdr'
@@ -38,9 +45,52 @@ freesurfer_lookup_table =pd.read_csv(
 targetLabels={'left':[1002,11026,21026,1012,1020,1028,1003,1014,1019,1027,1018],
                 'right':[2002,12026,22026,2012,2020,2028,2003,2014,2019,2027,2018]}
 
+# process the left and right hemispheres concurrently in subsegment_alic (roughly doubles peak memory)
+subsegment_parallel_sides = False
+# cache of the oriented tractogram: 'npy' (memory-mapped arrays in <name>_oriented.streams/) or 'tck'
+oriented_cache_format = 'npy'
+# also save each tractogram once as <name>.trx, with every target as a group of streamlines and the MNI
+# coordinates of the target streamlines as per-point data 'mni' (NaN for streamlines in no target)
+save_trx = False
+
+# select target streamlines from a single lookup of the atlas labels at both streamline endpoints,
+# instead of a full segmentation pass over the tractogram for every target
+subsegment_endpoint_lookup = False
+
+# rasterize each hemisphere's tractogram once and build the parent and all target density maps from it
+subsegment_rasterize_density = False
+
+# stream the tractograms in blocks of this many streamlines (ex. 100000) so that memory use is set by the block size
+# instead of the tractogram size; streamlines are always selected by endpoint labels and density maps rasterized per block.
+# None loads each tractogram whole
+subsegment_block_size = None
+
+# how vtk fiber bundles are written: 'native' (in-process writer, streamlineio.save_vtk) or 'tckconvert' (MRtrix in apptainer)
+vtk_writer = 'native'
+# write binary instead of ASCII vtk files (native writer only)
+vtk_binary = False
+
+# warp the target streamlines to MNI in-process with the fsl-format warp instead of warpinit/ApplyWarp + tcktransform
+native_streamline_warp = False
+# save the MNI-space target streamlines (*_mni.tck)
+save_mni_tck = True
+
 # anterior communisure displayed slice (level of anterior commissure is 3mm, 9mm is anterior, 1mm is posterior)
 coronal_slices_displayed_mm = [9, 6, 3, 1]
 
+# how streamlines overlapping the OCD response tract are found at the displayed coronal slices: 'roi' (wmaPyTools
+# segmentation with the voxel planar ROI, one pass per slice) or 'crossing' (points where the streamlines cross the
+# slice plane, interpolated between streamline points and looked up in the OCD response tract, all slices in one pass)
+ocd_response_backend = 'roi'
+
+# anterior-posterior overlap profile (MNI y, mm) saved by subsegment_alic, the per-slice csv tables are derived from it.
+# The profile covers ocd_profile_range_mm every ocd_profile_step_mm plus the displayed slices with the 'crossing' test;
+# with the 'roi' backend the planar ROI counts of the displayed slices are saved separately (roi_counts) and used for
+# their tables
+ocd_profile_range_mm = (-13, 19)
+ocd_profile_step_mm = 1
+ocd_profile_file = 'OCD_response_tract_profile.npz'
+
 # path to subcallosal cingulate cortex (SCC) mask to divide the rostral anterior cingulate cortex (rACC)
 splitraccplane = ALIC_TRACTOGRAPHY_DIR / 'indata/subcallosal_cingulate_mni.nii.gz'
 
@@ -70,6 +120,21 @@ ocd_response_tract_acpc = data_dir / 'ocd_response_tract_acpc.nii.gz'
 acpc_to_mni_xfm = data_dir / 'acpc_dc2standard.nii.gz'
 mni_to_acpc_xfm = data_dir / 'standard2acpc_dc.nii.gz'
 
+# backend used to transform centroids to MNI: 'native' applies the ITK displacement field in python,
+# 'slicer' runs 3D Slicer (reference implementation)
+point_transform_backend = 'native'
+
+# backend used to transform fiber bundles to DTI space: 'native' applies the linear transform in python,
+# 'slicer' runs 3D Slicer (all bundles of a subject in one session)
+bundle_transform_backend = 'native'
+
+# cache of converted transforms (FSL to MRtrix/ITK), shared across subjects, steps and reruns, relative to the processed
+# dataset root. Cached transforms are hardlinked into the subject directories: the size budget only counts (and evicts)
+# the transforms no subject links to anymore, the linked ones share their disk space with the subjects' copies
+use_transform_cache = True
+transform_cache_dir = Path('cache') / 'transforms'
+transform_cache_max_gb = 50
+
 # DTI to ACPC transform in ANTs format
 DTI_to_acpc_xfm = data_dir / 'from-DTI_to-acpc_xfm.txt'
 
@@ -80,15 +145,65 @@ mni_to_acpc_xfm_itk = data_dir / 'mni_to_acpc_xfm_itk.nii.gz'
 acpc_to_mni_xfm_itk = data_dir / 'acpc_to_mni_xfm_itk.nii.gz'
 
 # labels for divded dorsal/ventral rACC ROI
-rACC_split_labels = {11026: data_dir / 'lh_rostralanteriorcingulate_ROI_acpc_ventral.nii.gz',
-                     21026: data_dir / 'lh_rostralanteriorcingulate_ROI_acpc_dorsal.nii.gz',
-                    12026: data_dir / 'rh_rostralanteriorcingulate_ROI_acpc_ventral.nii.gz',
-                     22026: data_dir / 'rh_rostralanteriorcingulate_ROI_acpc_dorsal.nii.gz'}
+# aparc+aseg rACC label (lh, rh): [ventral label, dorsal label]
+rACC_split_labels = {1026: [11026, 21026],
+                     2026: [12026, 22026]}
 
 # labels for combined superior and inferior ALIC tractogram
 track_files = {
         'left': [ Path('app-track_aLIC/output/combined_aLIC_left.tck'),],
         'right': [ Path('app-track_aLIC/output/combined_aLIC_right.tck'),]}
 
+# ALIC masks generated by app-track_aLIC
+alic_mask_files = {
+        'left': Path('app-track_aLIC/output/ROIS/fullCutIC_ROI11_left.nii.gz'),
+        'right': Path('app-track_aLIC/output/ROIS/fullCutIC_ROI11_right.nii.gz')}
+
 # output folder
 saveFigDir = Path( 'output' )
+
+# record of completed processing steps, used to skip up-to-date steps and resume interrupted runs
+pipeline_state_file = Path('pipeline_state.json')
+# how step inputs are compared between runs: 'mtime' (size and modification time) or 'hash' (sha256 of the contents)
+step_signature = 'mtime'
+
+# how input data is brought into a subject's directory: 'copy', 'hardlink', 'reflink' (copy-on-write clone),
+# 'symlink' or 'auto' (reflink, falling back to hardlink, then copy). Linked inputs share their data with the
+# source dataset and must not be modified in place; symlinks must be reachable from within containers.
+import_strategy = 'auto'
+# record of imported files, unchanged sources are not imported again on rerun
+import_manifest_file = Path('import_manifest.json')
+# how imported sources are compared between runs: 'mtime' (size and modification time) or 'hash' (sha256)
+import_signature = 'mtime'
+# number of files imported concurrently
+import_workers = 4
+# how OCD diffusion data is resampled from DTI to ACPC space: 'native' (in python, streaming over volumes)
+# or 'ants' (ANTs ApplyTransforms through nipype)
+diffusion_resample_backend = 'native'
+# number of diffusion volumes held in memory, and resampled concurrently by as many threads, by the native backend
+resample_chunk_volumes = 8
+resample_workers = 1
+
+##---Containers---
+
+# container images run by alicpype itself (images used by app-track_aLIC are read from its main script)
+mrtrix_image = 'docker://brainlife/mrtrix3:3.0.0'
+container_images = [mrtrix_image]
+# run containers from local SIF images instead of pulling them, see `python -m alicpype.containers`
+use_container_cache = True
+# relative to the processed dataset root
+container_cache_dir = Path('cache') / 'sif'
+# pull missing images (when a batch starts and when a script is localized), set to False on offline nodes to fail
+# right away instead, after filling the cache with `python -m alicpype.containers --pull`
+container_pull_missing = True
+
+##---Batch processing---
+
+# number of subjects processed concurrently by the main_batch_*.py scripts
+batch_workers = 1
+# threads given to numpy/BLAS and to each external tool (MRtrix, ANTs, ...) within a worker, None leaves the environment untouched
+batch_threads_per_worker = None
+# address space limit (GB) of each worker, None for no limit
+batch_memory_gb = None
+# per-subject logs, relative to the processed dataset root
+batch_log_dir = Path('logs')
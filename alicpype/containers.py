@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# description: local cache of the apptainer images used by the pipeline, so that runs never pull images
+
+import re
+import os
+import sys
+import argparse
+from pathlib import Path
+from subprocess import run
+
+from . import config
+
+# container image references (ex. docker://brainlife/mrtrix3:3.0.0) within a script
+IMAGE_URI_PATTERN = re.compile(r'docker://[^\s"\'`;)]+')
+
+def sif_path(uri, cache_dir=None):
+    """
+    This function returns the path of the local SIF image caching a container image.
+    :uri:           image reference (ex. docker://brainlife/mrtrix3:3.0.0)
+    :cache_dir:     image cache directory, default config.container_cache_dir
+    """
+    cache_dir = Path(config.container_cache_dir if cache_dir is None else cache_dir)
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', uri.split('://', 1)[-1])
+    return cache_dir / (name + '.sif')
+
+def pull_image(uri, cache_dir=None):
+    """
+    This function converts a container image to a local SIF image in the cache.
+    :uri:           image reference
+    :cache_dir:     image cache directory, default config.container_cache_dir
+
+    :return: path to the SIF image
+    """
+    sif = sif_path(uri, cache_dir)
+    os.makedirs(sif.parent, exist_ok=True)
+    # pull next to the final name so that concurrent readers never see a partial image
+    tmp_sif = sif.with_name(sif.name + f'.{os.getpid()}.tmp')
+    print(f'pulling {uri} to {sif}')
+    try:
+        run(['apptainer', 'pull', '--force', str(tmp_sif), uri], check=True)
+        os.replace(tmp_sif, sif)
+    finally:
+        tmp_sif.unlink(missing_ok=True)
+    return sif
+
+def resolve_image(uri, cache_dir=None):
+    """
+    This function returns what to pass to apptainer for a container image: the cached SIF image (pulled once if
+    missing and config.container_pull_missing is set) when config.use_container_cache is set, otherwise the image
+    reference itself.
+    :uri:           image reference
+    :cache_dir:     image cache directory, default config.container_cache_dir
+    """
+    if not config.use_container_cache:
+        return uri
+    sif = sif_path(uri, cache_dir)
+    if not sif.is_file():
+        if not config.container_pull_missing:
+            raise FileNotFoundError(f'container image {uri} is not in the local cache ({sif}), fill the cache with '
+                f'`python -m alicpype.containers --pull` before running')
+        sif = pull_image(uri, cache_dir)
+    return str(sif)
+
+def script_images(script):
+    """
+    This function lists the container images referenced by a script (ex. app-track_aLIC/main).
+    :script:    script file
+    """
+    return sorted(set(IMAGE_URI_PATTERN.findall(Path(script).read_text())))
+
+def localize_script(script, out_file, cache_dir=None):
+    """
+    This function writes a copy of a script with the container images it references rewritten to the cached SIF
+    images. The script itself is left untouched (ex. the git-tracked main of an app-track_aLIC clone, or a link into
+    a shared install).
+    :script:        script file
+    :out_file:      localized copy of the script (ex. main.local, next to the script)
+    :cache_dir:     image cache directory, default config.container_cache_dir
+    """
+    script, out_file = Path(script), Path(out_file)
+    localized = IMAGE_URI_PATTERN.sub(lambda m: resolve_image(m.group(0), cache_dir), script.read_text())
+    out_file.unlink(missing_ok=True)
+    out_file.write_text(localized)
+    os.chmod(out_file, script.stat().st_mode)
+
+def required_images(app_dir=None, version=None):
+    """
+    This function lists every container image used by the pipeline: config.container_images plus the images
+    referenced by app-track_aLIC.
+    :app_dir:   app-track_aLIC install, default config.alic_app_dir
+    :version:   git revision of app-track_aLIC the subjects run, default config.alic_app_version (None: the
+                checked out main script)
+    """
+    app_dir = Path(config.alic_app_dir if app_dir is None else app_dir)
+    version = config.alic_app_version if version is None else version
+    images = set(config.container_images)
+    if version is not None:
+        # the pinned version may reference other images than the checked out one
+        p = run(['git', 'show', f'{version}:main'], cwd=app_dir, check=True, capture_output=True, text=True)
+        images.update(IMAGE_URI_PATTERN.findall(p.stdout))
+    elif (app_dir / 'main').is_file():
+        images.update(script_images(app_dir / 'main'))
+    return sorted(images)
+
+def preflight(images=None, cache_dir=None, pull=False):
+    """
+    This function checks that every container image is in the local cache.
+    :images:        image references, default required_images()
+    :cache_dir:     image cache directory, default config.container_cache_dir
+    :pull:          pull missing images instead of reporting them
+
+    :return: list of images missing from the cache
+    """
+    images = required_images() if images is None else images
+    missing = []
+    for uri in images:
+        sif = sif_path(uri, cache_dir)
+        if sif.is_file():
+            print(f'found {uri} at {sif}')
+        elif pull:
+            pull_image(uri, cache_dir)
+        else:
+            print(f'missing {uri} (expected at {sif})')
+            missing.append(uri)
+    return missing
+
+def main():
+    """
+    This function checks (and optionally fills) the local container image cache before a batch is started.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m alicpype.containers',
+        description='check that all container images used by the pipeline are in the local SIF cache')
+    parser.add_argument(
+        '--pull',
+        default=False,
+        action='store_true',
+        help='pull missing images into the cache. Default False.')
+    parser.add_argument(
+        '--alicpype-root',
+        default='.',
+        help='processed dataset from ALIC_tractography pipeline. Default: current directory.')
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        help=f'image cache directory. Default <alicpype_root>/{config.container_cache_dir}.')
+    args = parser.parse_args()
+    cache_dir = Path(args.alicpype_root) / config.container_cache_dir if args.cache_dir is None else args.cache_dir
+    missing = preflight(cache_dir=cache_dir, pull=args.pull)
+    sys.exit(1 if missing else 0)
+
+if __name__ == '__main__':
+    main()
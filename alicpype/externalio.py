@@ -4,43 +4,147 @@
 import os
 import shutil
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from . import config
+from .scheduler import file_signature, load_state, save_state
+from .registration import read_itk_affine, resample_nifti_affine
 import numpy as np
 
+IMPORT_STRATEGIES = ['copy', 'hardlink', 'reflink', 'symlink', 'auto']
+FICLONE = 0x40049409 # linux ioctl cloning a file on copy-on-write filesystems (btrfs, xfs)
+
+# copy-on-write clone of a file
+def reflink_file(source_file, dest_file):
+    """ 
+    This function clones a file without copying its data. Raises OSError if the filesystem does not support it.
+    :source_file:       file to clone
+    :dest_file:         clone to create
+    """
+    import fcntl
+    with open(source_file, 'rb') as src, open(dest_file, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dest_file)
+            raise
+
+# bring a single file into a subject directory
+def import_file(source_file, dest_file, strategy='copy'):
+    """ 
+    This function makes source_file available at dest_file, replacing any existing dest_file.
+    :source_file:       file to import
+    :dest_file:         destination path
+    :strategy:          one of IMPORT_STRATEGIES
+
+    :return: name of the strategy that was used
+    """
+    if strategy not in IMPORT_STRATEGIES:
+        raise ValueError(f'unknown import strategy {strategy}, expected one of {IMPORT_STRATEGIES}')
+    dest_file = Path(dest_file)
+    # never write through an earlier link to the source
+    if dest_file.is_symlink() or dest_file.exists():
+        dest_file.unlink()
+    if strategy == 'auto':
+        for fallback in ['reflink', 'hardlink']:
+            try:
+                return import_file(source_file, dest_file, fallback)
+            except OSError:
+                pass
+        strategy = 'copy'
+    if strategy == 'copy':
+        shutil.copyfile(source_file, dest_file)
+    elif strategy == 'hardlink':
+        os.link(source_file, dest_file)
+    elif strategy == 'reflink':
+        reflink_file(source_file, dest_file)
+    elif strategy == 'symlink':
+        os.symlink(Path(source_file).resolve(), dest_file)
+    return strategy
+
 # import data from a list of subjects
-def import_subject_from_list(subject_hcp_dir, cwd, to_copy): 
+def import_subject_from_list(subject_hcp_dir, cwd, to_copy, strategy=None): 
     """ 
-    This function copies over HCP-style data from a list of subjects
+    This function copies over HCP-style data from a list of subjects.
+    Imported files are recorded in config.import_manifest_file, files whose source is unchanged since the last
+    import are skipped. The remaining files are imported concurrently by config.import_workers threads.
     :subject_hcp_dir:     path to subject-specific directory where data will be copied from
     :cwd:                 path to subject-specific directory where data will be copied to
     :to_copy:             list of files to copy
+    :strategy:            how files are imported (see IMPORT_STRATEGIES), default config.import_strategy
     """
 
     subject_hcp_dir = Path(subject_hcp_dir) 
     cwd = Path(cwd) 
+    strategy = config.import_strategy if strategy is None else strategy
     print(cwd)
     assert(subject_hcp_dir.parent.is_dir())
+    manifest_file = cwd / config.import_manifest_file
+    manifest = load_state(manifest_file)
 
-    # copy over each image
+    # sources listed more than once are only brought over once, then linked
+    first_dest = {}
+    duplicates = []
     for source_file, dest_file in to_copy.values():
-        print(f'copying {source_file} to {dest_file}...')
+        source_file = subject_hcp_dir / source_file
         os.makedirs(
             (cwd / dest_file).parent, 
             exist_ok=True)
-        shutil.copyfile(
-            subject_hcp_dir / source_file,
-            cwd / dest_file)
+        if source_file in first_dest:
+            duplicates.append((source_file, dest_file))
+        else:
+            first_dest[source_file] = dest_file
 
-# import 3T HCP data
-def import_hcp_subject(subject, hcp_root, cwd):
+    def import_unchanged(source_file, dest_file):
+        signature = file_signature(source_file, config.import_signature)
+        if signature is None:
+            raise FileNotFoundError(source_file)
+        entry = manifest.get(str(dest_file))
+        if (entry is not None and entry['source'] == str(source_file) and entry['signature'] == signature
+                and (cwd / dest_file).exists()):
+            print(f'{dest_file} is up to date')
+            return entry
+        print(f'importing ({strategy}) {source_file} to {dest_file}...')
+        used = import_file(source_file, cwd / dest_file, strategy)
+        return {'source': str(source_file), 'signature': signature, 'strategy': used}
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.import_workers) as pool:
+            futures = {pool.submit(import_unchanged, source_file, dest_file): dest_file
+                for source_file, dest_file in first_dest.items()}
+            errors = []
+            for future in as_completed(futures):
+                try:
+                    manifest[str(futures[future])] = future.result()
+                except Exception as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+
+        for source_file, dest_file in duplicates:
+            entry = manifest[str(first_dest[source_file])]
+            if manifest.get(str(dest_file)) == entry and (cwd / dest_file).exists():
+                print(f'{dest_file} is up to date')
+                continue
+            print(f'linking {first_dest[source_file]} to {dest_file}...')
+            try:
+                import_file(cwd / first_dest[source_file], cwd / dest_file, 'hardlink')
+            except OSError:
+                import_file(source_file, cwd / dest_file, strategy)
+            manifest[str(dest_file)] = entry
+    finally:
+        # keep the record of whatever was imported, even if another file failed
+        save_state(manifest, manifest_file)
+
+# files imported from 3T HCP data
+def hcp_subject_files():
     """ 
-    This function imports 3T HCP-style data from a single subject.
-    :subject:              subject ID
-    :hcp_root:             path to HCP-style dataset
-    :cwd:                  path to subject-specific directory where data will be copied to
+    This function returns the files imported from a 3T HCP-style subject directory.
+
+    :return: dict of [source path relative to the subject directory, destination path relative to cwd]
     """
     # dict of all images copied
-    to_copy = {
+    return {
         'T1w_acpc':[
             'T1w/T1w_acpc_dc_restore_1.25.nii.gz', # source path (source_file)
             config.refT1Path], # destination path (dest_file)
@@ -66,21 +170,26 @@ def import_hcp_subject(subject, hcp_root, cwd):
             config.mni_to_acpc_xfm], 
         'acpc_to_mni_xfm':['MNINonLinear/xfms/acpc_dc2standard.nii.gz',
             config.acpc_to_mni_xfm]}
-    import_subject_from_list(hcp_root / subject, cwd, to_copy)
 
-# import 7T HCP data    
-def import_7T_hcp_subject(subject, hcp_root, cwd):
+# import 3T HCP data
+def import_hcp_subject(subject, hcp_root, cwd):
     """ 
-    This function imports 7T HCP-style data from a single subject and edits the bvals file.
-    edit_bvals_b9:              edit bvalues below defined threshold to be treated as b0
-
-    :subject:                   subject ID
-    :hcp_root:                  path to HCP-style dataset
-    :cwd:                       path to subject-specific directory where data will be copied to
+    This function imports 3T HCP-style data from a single subject.
+    :subject:              subject ID
+    :hcp_root:             path to HCP-style dataset
+    :cwd:                  path to subject-specific directory where data will be copied to
     """
+    import_subject_from_list(Path(hcp_root) / subject, cwd, hcp_subject_files())
+
+# files imported from 7T HCP data
+def hcp_7T_subject_files():
+    """ 
+    This function returns the files imported from a 7T HCP-style subject directory.
 
+    :return: dict of [source path relative to the subject directory, destination path relative to cwd]
+    """
     # dict of all images copied
-    to_copy = {
+    return {
         'T1w_acpc':[
             'T1w/T1w_acpc_dc_restore_1.05.nii.gz', # source path (source_file)
             config.refT1Path], # destination path (dest_file)
@@ -106,7 +215,19 @@ def import_7T_hcp_subject(subject, hcp_root, cwd):
             config.mni_to_acpc_xfm], 
         'acpc_to_mni_xfm':['MNINonLinear/xfms/acpc_dc2standard.nii.gz',
             config.acpc_to_mni_xfm]}
-    import_subject_from_list(hcp_root / subject, cwd, to_copy)
+
+# import 7T HCP data    
+def import_7T_hcp_subject(subject, hcp_root, cwd):
+    """ 
+    This function imports 7T HCP-style data from a single subject and edits the bvals file.
+    edit_bvals_b9:              edit bvalues below defined threshold to be treated as b0
+
+    :subject:                   subject ID
+    :hcp_root:                  path to HCP-style dataset
+    :cwd:                       path to subject-specific directory where data will be copied to
+    """
+    cwd = Path(cwd)
+    import_subject_from_list(Path(hcp_root) / subject, cwd, hcp_7T_subject_files())
     edit_bvals_b9(cwd/config.bvalsPath_raw, cwd/config.bvalsPath, config.b0_threshold) #call to edit_bvals_b9 function
 
 # edit bvals file if mets condition of defined b0_threshold
@@ -145,21 +266,25 @@ def apply_transform_to_nifti(input, ref_image, output, transform, input_dimensio
     at.run()
     return at.cmdline
 
-# import 7T OCD subject data
-def import_ocd_subject(subject, input_data_root, cwd):
+# subject directory of 7T OCD subject data
+def ocd_subject_dir(subject, input_data_root):
     """ 
-    This function imports 7T data from an individual OCD subject, edits the bvals file, and transform DTI to ACPC space.
-    import_subject_from_list:   import data from from a list of subjects
-    edit_bvals_b9:              edit bvalues below defined threshold to be treated as b0
-    apply_transform_to_nifti:   transform diffusion nifti image to ACPC space
-
+    This function returns the directory holding the data of an individual OCD subject.
     :subject:                   subject ID
-    :input_data_root:           path to dataset where data will be copied from
-    :cwd:                       path to subject-specific directory where data will be copied to
+    :input_data_root:           path to OCD patient dataset
     """
+    return Path(input_data_root) / f'dbspype/sub-{subject}'
 
+# files imported from 7T OCD subject data
+def ocd_subject_files(subject):
+    """ 
+    This function returns the files imported from an individual OCD subject directory.
+    :subject:                   subject ID
+
+    :return: dict of [source path relative to the subject directory, destination path relative to cwd]
+    """
     # dict of all images copied
-    to_copy = {
+    return {
         'T1w_acpc':[
             'ses-7T/T1_processing/Nifti/T1w/T1w_acpc_dc_restore.nii.gz', # source path (source_file)
             config.refT1Path], # destination path (dest_file)
@@ -186,11 +311,34 @@ def import_ocd_subject(subject, input_data_root, cwd):
         'acpc_to_mni_xfm':['ses-7T/T1_processing/Nifti/MNINonLinear/xfms/acpc_dc2standard.nii.gz',
             config.acpc_to_mni_xfm],
         'DTI_to_acpc_xfm':[f'ses-7T/xfm/sub-{subject}_ses-7T_from-DTI_to-acpc_xfm.txt', config.DTI_to_acpc_xfm]}
-    import_subject_from_list(Path(input_data_root) / f'dbspype/sub-{subject}', cwd, to_copy)
+
+# import 7T OCD subject data
+def import_ocd_subject(subject, input_data_root, cwd):
+    """ 
+    This function imports 7T data from an individual OCD subject, edits the bvals file, and transform DTI to ACPC space.
+    import_subject_from_list:   import data from from a list of subjects
+    edit_bvals_b9:              edit bvalues below defined threshold to be treated as b0
+    apply_transform_to_nifti:   transform diffusion nifti image to ACPC space (resample_nifti_affine with the native backend)
+
+    :subject:                   subject ID
+    :input_data_root:           path to dataset where data will be copied from
+    :cwd:                       path to subject-specific directory where data will be copied to
+    """
+    cwd = Path(cwd)
+    import_subject_from_list(ocd_subject_dir(subject, input_data_root), cwd, ocd_subject_files(subject))
     edit_bvals_b9(cwd/config.bvalsPath_raw, cwd/config.bvalsPath, config.b0_threshold)
-    apply_transform_to_nifti(cwd/config.diffPath_unregistered, 
-        cwd/config.refT1Path, 
-        cwd/config.diffPath, 
-        cwd/config.DTI_to_acpc_xfm)
+    if config.diffusion_resample_backend == 'native':
+        # from-DTI_to-acpc_xfm is linear: resample the diffusion series a few volumes at a time
+        resample_nifti_affine(cwd/config.diffPath_unregistered, 
+            cwd/config.refT1Path, 
+            cwd/config.diffPath, 
+            read_itk_affine(cwd/config.DTI_to_acpc_xfm),
+            chunk_size=config.resample_chunk_volumes,
+            n_workers=config.resample_workers)
+    else:
+        apply_transform_to_nifti(cwd/config.diffPath_unregistered, 
+            cwd/config.refT1Path, 
+            cwd/config.diffPath, 
+            cwd/config.DTI_to_acpc_xfm)
 
 
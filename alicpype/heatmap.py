@@ -1 +1,136 @@
-# UNUSED SO FAR... heatmaps generated at end of subsegment.py
\ No newline at end of file
+#!/usr/bin/env python3
+# description: streamline density maps (heatmaps) of the whole ALIC tractogram and its subsegmented target bundles
+
+import numpy as np
+import nibabel as nib
+from scipy import ndimage
+
+# convert world coordinates to voxel indices
+def points_to_voxels(points, affine):
+    """
+    This function converts points in world (mm) coordinates to voxel indices of an image, rounding to the
+    nearest voxel center (same convention as dipy's density_map)
+    :points:    N x 3 array of points
+    :affine:    voxel to world affine of the image
+
+    :return: N x 3 integer array of voxel indices
+    """
+    return np.floor(nib.affines.apply_affine(np.linalg.inv(affine), points) + 0.5).astype(np.intp)
+
+# smallest unsigned integer type holding a density map
+def compact_dtype(max_count):
+    """
+    This function returns the smallest unsigned integer dtype that can hold a streamline count.
+    :max_count:     largest count in the density map
+    """
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if max_count <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+# rasterize a tractogram once so that density maps of any subset of it can be built without touching the points again
+def rasterize_streamlines(streams, affine, shape, chunk_size=100000):
+    """
+    This function lists the voxels visited by every streamline, each (voxel, streamline) pair once.
+    :streams:       input streamlines
+    :affine:        voxel to world affine of the density map
+    :shape:         shape of the density map
+    :chunk_size:    number of streamlines rasterized at a time (bounds the temporary memory)
+
+    :return: (voxel_index, streamline_index) flat voxel index and streamline index of every visited voxel
+    """
+    streams = nib.streamlines.ArraySequence(streams)
+    shape = tuple(shape[:3])
+    n_voxels = int(np.prod(shape))
+    voxel_dtype = np.int32 if n_voxels < np.iinfo(np.int32).max else np.int64
+    # kept for every (voxel, streamline) pair, so stored with 4 bytes when the number of streamlines allows it
+    streamline_dtype = np.int32 if len(streams) < np.iinfo(np.int32).max else np.int64
+    voxel_index = []
+    streamline_index = []
+    for start in range(0, len(streams), chunk_size):
+        chunk = streams[start:start + chunk_size]
+        voxels = points_to_voxels(chunk.get_data(), affine)
+        if np.any(voxels < 0) or np.any(voxels >= shape):
+            raise IndexError('streamline points outside the density map')
+        # combine streamline and voxel into one key so that repeated visits of a voxel are counted once
+        flat = np.ravel_multi_index(tuple(voxels.T), shape).astype(np.int64)
+        owner = np.repeat(np.arange(len(chunk), dtype=np.int64), chunk._lengths)
+        keys = np.unique(owner * n_voxels + flat)
+        voxel_index.append((keys % n_voxels).astype(voxel_dtype))
+        streamline_index.append((keys // n_voxels + start).astype(streamline_dtype))
+    if len(voxel_index) == 0:
+        return np.zeros(0, dtype=voxel_dtype), np.zeros(0, dtype=streamline_dtype)
+    return np.concatenate(voxel_index), np.concatenate(streamline_index)
+
+# density map of a subset of a rasterized tractogram
+def density_from_rasterized(rasterized, shape, selection=None):
+    """
+    This function builds the density map (number of streamlines per voxel) of a subset of a rasterized tractogram.
+    :rasterized:    (voxel_index, streamline_index) from rasterize_streamlines
+    :shape:         shape of the density map
+    :selection:     indices or boolean mask of the selected streamlines, None for all streamlines
+
+    :return: integer density map of shape `shape`
+    """
+    voxel_index, streamline_index = rasterized
+    shape = tuple(shape[:3])
+    if selection is None:
+        selected_voxels = voxel_index
+    else:
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            membership = selection
+        else:
+            # streamlines without points visit no voxel, so the selection may go beyond the largest streamline index
+            n_streams = max(int(streamline_index.max()) + 1 if streamline_index.size else 0,
+                int(selection.max()) + 1 if selection.size else 0)
+            membership = np.zeros(n_streams, dtype=bool)
+            membership[selection] = True
+        selected_voxels = voxel_index[membership[streamline_index]]
+    counts = np.bincount(selected_voxels, minlength=int(np.prod(shape)))
+    return counts.reshape(shape)
+
+# save out a density map with a compact integer dtype
+def save_density_volume(density, ref_img, out_file):
+    """
+    This function saves a density map in the space of a reference image, using the smallest integer dtype that holds it.
+    :density:   density map
+    :ref_img:   reference image (e.g. T1)
+    :out_file:  output nifti file
+    """
+    dtype = compact_dtype(density.max() if density.size else 0)
+    density = np.asarray(density, dtype=dtype)
+    header = ref_img.header.copy()
+    header.set_data_dtype(dtype)
+    densityNifti = nib.nifti1.Nifti1Image(density, ref_img.affine, header)
+    densityNifti.header.set_slope_inter(1, 0)
+    nib.save(densityNifti, out_file)
+
+# center of mass of every slice of a density map restricted to a mask
+def centerofmass_by_slice(density, mask, APaxis=1):
+    """
+    This function calculates the center of mass of each slice of a density map multiplied by a mask (same result as
+    calling ndimage.center_of_mass on every slice of density * mask). Slices outside the mask are skipped.
+    :density:   density map (nifti image or array)
+    :mask:      mask (or weights) in the grid of the density map
+    :APaxis:    image axis along which slices are taken
+
+    :return: num_slices x 3 array of voxel coordinates, NaN for empty slices
+    """
+    mask = np.asanyarray(mask)
+    in_plane_axes = [i for i in range(3) if i != APaxis]
+    centerofmass = np.full((mask.shape[APaxis], 3), np.nan)
+    inside = np.flatnonzero(np.any(mask, axis=tuple(in_plane_axes)))
+    if len(inside) == 0:
+        return centerofmass
+    density = density.get_fdata() if isinstance(density, nib.spatialimages.SpatialImage) else np.asanyarray(density)
+    # the whole product keeps the memory layout, hence the summation order (and rounding), of ndimage.center_of_mass
+    # on the slices of density * mask; cropping the slices in-plane would change it
+    in_img = density * mask
+    for iSlice in range(inside[0], inside[-1] + 1):
+        img_slice = [slice(None)] * 3
+        img_slice[APaxis] = iSlice
+        tmp = ndimage.center_of_mass(in_img[tuple(img_slice)], labels=None, index=None)
+        centerofmass[iSlice, in_plane_axes] = tmp
+        centerofmass[iSlice, APaxis] = iSlice
+    return centerofmass
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# description: load and save label volumes (parcellations) and masks with compact integer data types
+
+from pathlib import Path
+import numpy as np
+import nibabel as nib
+
+# smallest data type holding a range of labels
+def label_dtype(labels):
+    """
+    This function returns the smallest integer data type (uint8, int16 or int32) holding every value of a label array.
+    :labels:    integer array
+    """
+    if labels.size == 0:
+        return np.dtype(np.uint8)
+    low, high = labels.min(), labels.max()
+    for dtype in [np.uint8, np.int16, np.int32]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f'labels range [{low}, {high}] does not fit in int32')
+
+def _load(img):
+    return nib.load(img) if isinstance(img, (str, Path)) else img
+
+def load_labels(img):
+    """
+    This function loads a label volume as a compact integer array straight from the stored data, without going
+    through float64 (get_fdata). Labels stored as floats are rounded.
+    :img:       label nifti (path or nibabel image)
+
+    :return: integer array (uint8, int16 or int32)
+    """
+    labels = np.asanyarray(_load(img).dataobj)
+    if not np.issubdtype(labels.dtype, np.integer):
+        labels = np.rint(labels).astype(np.int32)
+    return labels.astype(label_dtype(labels), copy=False)
+
+def load_mask(img, threshold=0.5):
+    """
+    This function loads a mask as a boolean array.
+    :img:           mask nifti (path or nibabel image)
+    :threshold:     voxels above this value are in the mask
+
+    :return: boolean array
+    """
+    return np.asanyarray(_load(img).dataobj) > threshold
+
+def labels_image(labels, ref_img):
+    """
+    This function wraps a label or mask array into a nifti image stored with the smallest integer data type
+    (masks are stored as uint8).
+    :labels:    integer or boolean array
+    :ref_img:   image providing the affine and header
+
+    :return: nibabel Nifti1Image
+    """
+    labels = np.asarray(labels)
+    if labels.dtype == bool:
+        labels = labels.astype(np.uint8)
+    labels = labels.astype(label_dtype(labels), copy=False)
+    img = nib.Nifti1Image(labels, ref_img.affine, header=ref_img.header)
+    img.set_data_dtype(labels.dtype)
+    # the labels are stored as is
+    img.header.set_slope_inter(1, 0)
+    return img
+
+def save_labels(labels, ref_img, out_file):
+    """
+    This function saves a label or mask array with the smallest integer data type.
+    :labels:    integer or boolean array
+    :ref_img:   image providing the affine and header
+    :out_file:  output nifti
+    """
+    nib.save(labels_image(labels, ref_img), out_file)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# description: anterior-posterior profile of the overlap between the target bundles and the OCD response tract
+
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from . import config
+
+# coronal planes of the profile
+def profile_planes(start=None, stop=None, step=None, include=None):
+    """
+    This function returns the coronal plane positions (MNI y, mm) of the overlap profile, from start to stop
+    (inclusive) every step mm, plus the slices in include.
+    :start:     most posterior plane (mm), default config.ocd_profile_range_mm[0]
+    :stop:      most anterior plane (mm), default config.ocd_profile_range_mm[1]
+    :step:      distance between planes (mm), default config.ocd_profile_step_mm
+    :include:   additional planes, default the displayed slices (config.coronal_slices_displayed_mm)
+    """
+    start = config.ocd_profile_range_mm[0] if start is None else start
+    stop = config.ocd_profile_range_mm[1] if stop is None else stop
+    step = config.ocd_profile_step_mm if step is None else step
+    include = config.coronal_slices_displayed_mm if include is None else include
+    planes = start + step * np.arange(int(np.floor((stop - start) / step + 1e-6)) + 1)
+    return np.union1d(np.round(planes, 6), np.asarray(include, dtype=np.float64))
+
+def save_ocd_profile(out_file, targets, slices_mm, counts, n_streamlines, roi_slices_mm=(), roi_counts=None):
+    """
+    This function saves the overlap profile of a subject: the number and percentage of the streamlines of every
+    target crossing the OCD response tract at every coronal plane, and at the displayed slices the number and
+    percentage of the streamlines found with the planar ROIs ('roi' backend), kept apart from the crossing counts.
+    :out_file:          output .npz file
+    :targets:           target names
+    :slices_mm:         coronal plane positions (MNI y, mm)
+    :counts:            number of streamlines crossing the OCD response tract (targets x slices)
+    :n_streamlines:     number of streamlines of every target
+    :roi_slices_mm:     coronal slices (MNI y, mm) segmented with the planar ROIs, none with the 'crossing' backend
+    :roi_counts:        number of streamlines overlapping the planar ROIs (targets x roi slices)
+    """
+    counts = np.asarray(counts, dtype=np.int64).reshape(len(targets), len(slices_mm))
+    roi_counts = np.asarray([] if roi_counts is None else roi_counts, dtype=np.int64).reshape(len(targets), len(roi_slices_mm))
+    n_streamlines = np.asarray(n_streamlines, dtype=np.int64)
+    # percent of a target without streamlines is undefined (NaN), as in the per-slice tables
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percent = counts / n_streamlines[:, None] * 100
+        roi_percent = roi_counts / n_streamlines[:, None] * 100
+    np.savez_compressed(out_file, targets=np.asarray(targets, dtype=str), slices_mm=np.asarray(slices_mm, dtype=np.float64),
+        counts=counts.astype(np.uint32), n_streamlines=n_streamlines, percent=percent,
+        roi_slices_mm=np.asarray(roi_slices_mm, dtype=np.float64), roi_counts=roi_counts.astype(np.uint32), roi_percent=roi_percent)
+
+def load_ocd_profile(in_file):
+    """
+    This function loads an overlap profile saved by save_ocd_profile.
+    :in_file:   profile .npz file
+
+    :return: dict with targets, slices_mm, counts, n_streamlines, percent, roi_slices_mm, roi_counts and roi_percent
+    """
+    with np.load(in_file) as profile:
+        return {key: profile[key] for key in profile.files}
+
+def slice_table(profile, slice_mm):
+    """
+    This function returns the table of one coronal slice of an overlap profile, from the planar ROI counts at the
+    slices segmented with the planar ROIs and from the crossing counts elsewhere.
+    :profile:   overlap profile (load_ocd_profile)
+    :slice_mm:  coronal plane position (MNI y, mm), must be one of the planes of the profile
+
+    :return: DataFrame with columns target, number_of_streamlines and percent_streamlines
+    """
+    for slices_key, counts_key, percent_key in [('roi_slices_mm', 'roi_counts', 'roi_percent'),
+            ('slices_mm', 'counts', 'percent')]:
+        index = np.flatnonzero(np.isclose(profile.get(slices_key, []), slice_mm))
+        if len(index) > 0:
+            return pd.DataFrame({'target': profile['targets'],
+                'number_of_streamlines': profile[counts_key][:, index[0]].astype(np.int64),
+                'percent_streamlines': profile[percent_key][:, index[0]]})
+    raise KeyError(f'{slice_mm} mm is not a slice of the profile ({profile["slices_mm"].min():g} to '
+        f'{profile["slices_mm"].max():g} mm, {len(profile["slices_mm"])} slices), rerun subsegment_alic with '
+        f'config.ocd_profile_range_mm and config.ocd_profile_step_mm covering it')
+
+def save_slice_tables(profile_file, out_dir, slices_mm=None):
+    """
+    This function writes the per-slice tables ({slice}_OCD_response_tract_streams.csv) of an overlap profile.
+    :profile_file:  profile .npz file
+    :out_dir:       output directory
+    :slices_mm:     coronal slices to write, default config.coronal_slices_displayed_mm
+    """
+    slices_mm = config.coronal_slices_displayed_mm if slices_mm is None else slices_mm
+    profile = load_ocd_profile(profile_file)
+    for slice_mm in slices_mm:
+        out_file = Path(out_dir) / ('%g_OCD_response_tract_streams.csv' % slice_mm)
+        slice_table(profile, slice_mm).to_csv(out_file, index=False)
+
+def main():
+    """
+    This function writes the per-slice tables of a subject from its overlap profile, for any slice of the profile.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m alicpype.ocdprofile',
+        description='write {slice}_OCD_response_tract_streams.csv tables from an OCD response tract overlap profile')
+    parser.add_argument(
+        'profile_file',
+        help=f'overlap profile of a subject ({config.saveFigDir / config.ocd_profile_file} of the subject).')
+    parser.add_argument(
+        '--slices',
+        type=float,
+        nargs='+',
+        default=config.coronal_slices_displayed_mm,
+        help='coronal slices (MNI y, mm). Default %(default)s.')
+    parser.add_argument(
+        '--out-dir',
+        default=None,
+        help='output directory. Default: directory of the profile.')
+    args = parser.parse_args()
+    profile_file = Path(args.profile_file)
+    save_slice_tables(profile_file, profile_file.parent if args.out_dir is None else args.out_dir, args.slices)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# description: test where streamlines cross planes (ex. coronal slices) analytically instead of with voxel ROIs
+
+import numpy as np
+import nibabel as nib
+
+from .heatmap import points_to_voxels
+
+# find, for every plane, the streamlines crossing it inside a planar ROI
+def streams_crossing_planes(streams, planes, masks, affine, axis=1):
+    """
+    This function finds the streamline segments crossing each plane (world coordinate `axis` equal to the plane
+    position), interpolates the crossing points and looks them up in the planar ROI of the plane. All planes are
+    tested in a single pass over the points.
+    :streams:   streamlines in world (mm) coordinates
+    :planes:    positions (mm) of the planes along `axis`
+    :masks:     one boolean volume per plane (ex. the planar OCD response tract ROIs), or a single volume shared by all
+                planes (ex. the OCD response tract, the crossing points lie on the plane)
+    :affine:    voxel to world affine of the masks
+    :axis:      world axis normal to the planes (1: coronal planes)
+
+    :return: boolean array (number of planes x number of streamlines), streamlines crossing each plane in its ROI
+    """
+    streams = nib.streamlines.ArraySequence(streams)
+    planes = np.asarray(planes, dtype=np.float64)
+    masks = np.asarray(masks, dtype=bool)
+    lengths = np.asarray(streams._lengths, dtype=np.int64)
+    hits = np.zeros((len(planes), len(lengths)), dtype=bool)
+    if lengths.sum() == 0 or len(planes) == 0:
+        return hits
+
+    # segments between consecutive points of the same streamline
+    points = np.asarray(streams.get_data(), dtype=np.float64).reshape(-1, 3)
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    start = np.flatnonzero(owner[:-1] == owner[1:])
+    a, b = points[start, axis], points[start + 1, axis]
+
+    # planes between the two ends of every segment (planes sorted for searchsorted)
+    order = np.argsort(planes)
+    sorted_planes = planes[order]
+    low = np.searchsorted(sorted_planes, np.minimum(a, b), side='left')
+    high = np.searchsorted(sorted_planes, np.maximum(a, b), side='right')
+    n_crossed = high - low
+    segment = np.repeat(np.arange(len(start)), n_crossed)
+    # rank of each crossed plane within its segment
+    rank = np.arange(len(segment)) - np.repeat(np.cumsum(n_crossed) - n_crossed, n_crossed)
+    plane = order[low[segment] + rank]
+
+    # interpolate the crossing points (a segment lying in the plane crosses at its first point)
+    delta = b[segment] - a[segment]
+    fraction = np.divide(planes[plane] - a[segment], delta, out=np.zeros(len(segment)), where=delta != 0)
+    first = points[start[segment]]
+    crossing = first + fraction[:, None] * (points[start[segment] + 1] - first)
+
+    voxels = points_to_voxels(crossing, affine)
+    inside = np.all((voxels >= 0) & (voxels < masks.shape[-3:]), axis=1)
+    in_roi = np.zeros(len(segment), dtype=bool)
+    if masks.ndim == 3:
+        in_roi[inside] = masks[tuple(voxels[inside].T)]
+    else:
+        in_roi[inside] = masks[(plane[inside], *voxels[inside].T)]
+    hits[plane[in_roi], owner[start[segment[in_roi]]]] = True
+    return hits
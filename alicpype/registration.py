@@ -1,2 +1,321 @@
 #!/usr/bin/env python3
-#HCP data should be coregistered so skip this step
\ No newline at end of file
+# description: in-process application of the transforms used by the pipeline to points and streamlines
+
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nibabel as nib
+from scipy import ndimage
+
+# mapping from voxel indices to FSL "scaled voxel" coordinates
+def fsl_voxel_to_scaled(img):
+    """
+    This function returns the 4x4 matrix mapping voxel indices of an image to FSL scaled-voxel (mm) coordinates.
+    FSL flips the first axis of images stored with a positive determinant (neurological orientation).
+    :img:   nibabel image
+    """
+    zooms = np.asarray(img.header.get_zooms()[:3], dtype=float)
+    scaled = np.diag([*zooms, 1.0])
+    if np.linalg.det(img.affine[:3, :3]) > 0:
+        scaled[0, 0] = -zooms[0]
+        scaled[0, 3] = (img.shape[0] - 1) * zooms[0]
+    return scaled
+
+# trilinear interpolation of a vector field at arbitrary voxel coordinates
+def interpolate_field(field, voxels):
+    """
+    This function interpolates a vector field at voxel coordinates. Values outside the field are taken from the
+    nearest voxel on its border.
+    :field:     X x Y x Z x 3 array
+    :voxels:    N x 3 array of (fractional) voxel coordinates
+
+    :return: N x 3 array of interpolated vectors
+    """
+    values = np.empty((len(voxels), field.shape[-1]), dtype=np.float64)
+    for i in range(field.shape[-1]):
+        values[:, i] = ndimage.map_coordinates(field[..., i], voxels.T, order=1, mode='nearest')
+    return values
+
+# nearest neighbour resampling of a volume onto another grid
+def resample_nearest(data, in_affine, out_affine, out_shape, out=None):
+    """
+    This function resamples a 3D array onto another voxel grid with nearest neighbour interpolation (the AFNI
+    3dresample default), one slab at a time. Voxels falling outside of the input are set to 0.
+    :data:          X x Y x Z input array
+    :in_affine:     voxel to world affine of the input
+    :out_affine:    voxel to world affine of the output grid
+    :out_shape:     shape of the output grid
+    :out:           optional X x Y x Z array to write the result into
+
+    :return: resampled array
+    """
+    out = np.zeros(out_shape, dtype=data.dtype) if out is None else out
+    out_to_in = np.linalg.inv(in_affine) @ out_affine
+    in_plane = np.stack(np.meshgrid(np.arange(out_shape[1]), np.arange(out_shape[2]), indexing='ij'), axis=-1)
+    slab = np.concatenate([np.zeros(in_plane.shape[:2] + (1,)), in_plane], axis=-1)
+    for i in range(out_shape[0]):
+        slab[..., 0] = i
+        voxels = np.floor(nib.affines.apply_affine(out_to_in, slab) + 0.5).astype(np.intp)
+        inside = np.all((voxels >= 0) & (voxels < data.shape[:3]), axis=-1)
+        out[i][inside] = data[voxels[inside, 0], voxels[inside, 1], voxels[inside, 2]]
+        out[i][~inside] = 0
+    return out
+
+@dataclass
+class FslWarp:
+    """
+    An FSL-format warp field loaded in memory.
+    :field:             X x Y x Z x 3 displacement (relative) or position (absolute) field, FSL mm coordinates
+    :world_to_voxel:    maps world (mm) coordinates to voxel coordinates of the field
+    :voxel_to_scaled:   maps voxel coordinates of the field to FSL scaled-voxel coordinates
+    :scaled_to_world:   maps FSL scaled-voxel coordinates of the warped-to image to world (mm) coordinates
+    :relative:          whether the field holds displacements (True) or absolute positions (False)
+    """
+    field: np.ndarray
+    world_to_voxel: np.ndarray
+    voxel_to_scaled: np.ndarray
+    scaled_to_world: np.ndarray
+    relative: bool = True
+
+def load_fsl_warp(warp_file, in_image, relative=True):
+    """
+    This function loads an FSL-format warp (as used by applywarp) to transform points. For a warp used as
+    `applywarp --in=A --ref=B --warp=warp_file`, points in the space of B are mapped to the space of A, so the
+    "mni_to_acpc" (standard2acpc) warp maps acpc points to MNI.
+    :warp_file:     FSL-format warp field
+    :in_image:      image defining the coordinate system the warp points into (the --in image of applywarp)
+    :relative:      whether the field holds relative displacements (FSL default) or absolute positions
+
+    :return: FslWarp
+    """
+    warp = nib.load(warp_file)
+    in_image = nib.load(in_image) if isinstance(in_image, (str, Path)) else in_image
+    field = np.asarray(warp.dataobj, dtype=np.float32).reshape(warp.shape[:3] + (3,))
+    return FslWarp(field=field,
+        world_to_voxel=np.linalg.inv(warp.affine),
+        voxel_to_scaled=fsl_voxel_to_scaled(warp),
+        scaled_to_world=in_image.affine @ np.linalg.inv(fsl_voxel_to_scaled(in_image)),
+        relative=relative)
+
+def apply_fsl_warp(points, warp):
+    """
+    This function transforms points with an FSL-format warp using trilinear interpolation of the field.
+    :points:    N x 3 array of points in world (mm) coordinates
+    :warp:      FslWarp from load_fsl_warp
+
+    :return: N x 3 array of transformed points
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    voxels = nib.affines.apply_affine(warp.world_to_voxel, points)
+    scaled = interpolate_field(warp.field, voxels)
+    if warp.relative:
+        scaled += nib.affines.apply_affine(warp.voxel_to_scaled, voxels)
+    return nib.affines.apply_affine(warp.scaled_to_world, scaled)
+
+def apply_fsl_warp_to_image(in_image, warp, ref_image, order=0):
+    """
+    This function resamples an image through an FSL-format warp onto the grid of a reference image, like
+    `applywarp --in=in_image --ref=ref_image --warp=...`, one slab at a time. Voxels mapped outside the input are 0.
+    :in_image:      image to resample (the --in image of applywarp)
+    :warp:          FslWarp from load_fsl_warp
+    :ref_image:     image defining the output grid (the --ref image of applywarp)
+    :order:         interpolation order (0: nearest neighbour, 1: trilinear)
+
+    :return: resampled array on the grid of ref_image, with the data type of in_image
+    """
+    in_image = nib.load(in_image) if isinstance(in_image, (str, Path)) else in_image
+    ref_image = nib.load(ref_image) if isinstance(ref_image, (str, Path)) else ref_image
+    in_data = np.asanyarray(in_image.dataobj)
+    world_to_in = np.linalg.inv(in_image.affine)
+    out_shape = ref_image.shape[:3]
+    out = np.zeros(out_shape, dtype=in_data.dtype)
+    in_plane = np.stack(np.meshgrid(np.arange(out_shape[1]), np.arange(out_shape[2]), indexing='ij'), axis=-1)
+    slab = np.concatenate([np.zeros(in_plane.shape[:2] + (1,)), in_plane], axis=-1).reshape(-1, 3)
+    for i in range(out_shape[0]):
+        slab[:, 0] = i
+        points = apply_fsl_warp(nib.affines.apply_affine(ref_image.affine, slab), warp)
+        voxels = nib.affines.apply_affine(world_to_in, points)
+        out[i] = ndimage.map_coordinates(in_data, voxels.T, order=order, mode='constant', cval=0,
+            output=in_data.dtype).reshape(out_shape[1:])
+    return out
+
+def warp_streamlines(streams, warp):
+    """
+    This function transforms all points of a set of streamlines with an FSL-format warp in a single vectorized pass.
+    :streams:   input streamlines in world (mm) coordinates
+    :warp:      FslWarp from load_fsl_warp
+
+    :return: transformed streamlines (ArraySequence)
+    """
+    streams = nib.streamlines.ArraySequence(streams)
+    lengths = np.asarray(streams._lengths)
+    warped = nib.streamlines.ArraySequence()
+    warped._data = apply_fsl_warp(streams.get_data(), warp).astype(np.float32)
+    warped._lengths = lengths.copy()
+    warped._offsets = (np.cumsum(lengths) - lengths).astype(streams._offsets.dtype)
+    return warped
+
+@dataclass
+class ItkDisplacementField:
+    """
+    An ITK displacement field transform loaded in memory.
+    :field:             X x Y x Z x 3 displacement field, RAS (mm) coordinates
+    :world_to_voxel:    maps world (mm) coordinates to voxel coordinates of the field
+    """
+    field: np.ndarray
+    world_to_voxel: np.ndarray
+
+def load_itk_displacement_field(xfm_file):
+    """
+    This function loads an ITK displacement field (X x Y x Z x 1 x 3 nifti, as read by ANTs and 3D Slicer).
+    ITK stores displacements in LPS, they are converted to RAS here.
+    :xfm_file:  ITK-format displacement field
+
+    :return: ItkDisplacementField
+    """
+    xfm = nib.load(xfm_file)
+    field = np.asarray(xfm.dataobj, dtype=np.float32).reshape(xfm.shape[:3] + (3,))
+    field[..., :2] *= -1 # LPS to RAS
+    return ItkDisplacementField(field=field, world_to_voxel=np.linalg.inv(xfm.affine))
+
+def apply_itk_displacement_field(points, xfm, inverse=False, max_iterations=100, tolerance=1e-4):
+    """
+    This function transforms points with an ITK displacement field, p -> p + d(p), using trilinear interpolation
+    of the field. The inverse is found by fixed-point iteration of q = p - d(q).
+    :points:            N x 3 array of points in world (RAS, mm) coordinates
+    :xfm:               ItkDisplacementField from load_itk_displacement_field
+    :inverse:           apply the inverse of the transform
+    :max_iterations:    maximum number of iterations of the inversion
+    :tolerance:         inversion stops once all points are within this distance (mm) of their solution
+
+    :return: N x 3 array of transformed points
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    displacement = lambda p: interpolate_field(xfm.field, nib.affines.apply_affine(xfm.world_to_voxel, p))
+    if not inverse:
+        return points + displacement(points)
+    transformed = points - displacement(points)
+    for _ in range(max_iterations):
+        residual = points - (transformed + displacement(transformed))
+        transformed += residual
+        if np.all(np.linalg.norm(residual, axis=1) < tolerance):
+            break
+    return transformed
+
+def transform_points_itk(points, xfm_file):
+    """
+    This function transforms points with an ITK displacement field the way 3D Slicer hardens a transform loaded
+    from file. Slicer reads the file as the resampling (FromParent) transform, so points are mapped with its inverse.
+    :points:    N x 3 array of points in world (RAS, mm) coordinates
+    :xfm_file:  ITK-format displacement field (ex. acpc_to_mni_xfm_itk.nii.gz)
+
+    :return: N x 3 array of transformed points
+    """
+    return apply_itk_displacement_field(points, load_itk_displacement_field(xfm_file), inverse=True)
+
+# linear ITK transform (as written by ANTs and 3D Slicer) as a RAS affine
+def read_itk_affine(xfm_file):
+    """
+    This function reads a linear ITK text transform (ex. AffineTransform_double_3_3) and returns the 4x4 matrix
+    mapping RAS points the same way the ITK transform maps LPS points.
+    :xfm_file:  ITK-format text transform file
+
+    :return: 4x4 affine matrix in RAS coordinates
+    """
+    fields = {}
+    with open(xfm_file) as f:
+        for line in f:
+            if ':' in line and not line.startswith('#'):
+                key, value = line.split(':', 1)
+                if key in fields:
+                    raise ValueError(f'{xfm_file} holds more than one transform')
+                fields[key.strip()] = value.split()
+    parameters = np.array(fields['Parameters'], dtype=float)
+    center = np.array(fields.get('FixedParameters', [0, 0, 0]), dtype=float)
+    if len(parameters) != 12 or len(center) != 3:
+        raise ValueError(f'{xfm_file} is not a linear 3D transform ({fields["Transform"][0]})')
+    matrix = parameters[:9].reshape(3, 3)
+    lps = np.eye(4)
+    lps[:3, :3] = matrix
+    lps[:3, 3] = parameters[9:] + center - matrix @ center
+    lps_to_ras = np.diag([-1.0, -1.0, 1.0, 1.0])
+    return lps_to_ras @ lps @ lps_to_ras
+
+def transform_streamlines(streams, affine):
+    """
+    This function applies an affine to all points of a set of streamlines.
+    :streams:   input streamlines in world (mm) coordinates
+    :affine:    4x4 affine matrix
+
+    :return: transformed streamlines (ArraySequence)
+    """
+    streams = nib.streamlines.ArraySequence(streams)
+    lengths = np.asarray(streams._lengths)
+    transformed = nib.streamlines.ArraySequence()
+    points = np.asarray(streams.get_data(), dtype=np.float64).reshape(-1, 3)
+    transformed._data = nib.affines.apply_affine(affine, points).astype(np.float32)
+    transformed._lengths = lengths.copy()
+    transformed._offsets = (np.cumsum(lengths) - lengths).astype(streams._offsets.dtype)
+    return transformed
+
+# read the volumes of a (4D) nifti one after the other without loading the whole series
+def iter_nifti_volumes(in_file):
+    """
+    This function reads the 3D volumes of a nifti file sequentially, decompressing it only once.
+    :in_file:   (4D) nifti file
+
+    :return: iterator over X x Y x Z float32 arrays (scaling applied)
+    """
+    proxy = nib.load(in_file).dataobj # on-disk layout and scaling of the data
+    shape = proxy.shape[:3]
+    n_volumes = int(np.prod(proxy.shape[3:]))
+    volume_bytes = int(np.prod(shape)) * proxy.dtype.itemsize
+    with nib.openers.ImageOpener(in_file, 'rb') as f:
+        f.seek(proxy.offset)
+        for _ in range(n_volumes):
+            volume = np.frombuffer(f.read(volume_bytes), dtype=proxy.dtype).reshape(shape, order='F')
+            yield (volume * np.float32(proxy.slope) + np.float32(proxy.inter)).astype(np.float32)
+
+# resample a (4D) nifti through an affine, streaming over its volumes
+def resample_nifti_affine(in_file, ref_image, out_file, affine, chunk_size=8, n_workers=1):
+    """
+    This function resamples every volume of a nifti onto the grid of a reference image with trilinear
+    interpolation (like ANTs ApplyTransforms with a linear transform), writing volumes as they are done.
+    Memory use is bounded by chunk_size volumes instead of the whole series.
+    :in_file:       input (4D) nifti
+    :ref_image:     reference image defining the output grid
+    :out_file:      output nifti (float32)
+    :affine:        4x4 RAS affine mapping points of the reference space to the input space
+                    (ex. read_itk_affine of the transform given to ApplyTransforms)
+    :chunk_size:    number of volumes held in memory at once
+    :n_workers:     number of threads resampling the volumes of a chunk
+    """
+    img = nib.load(in_file)
+    ref = nib.load(ref_image) if isinstance(ref_image, (str, Path)) else ref_image
+    out_shape = ref.shape[:3]
+    # output voxel -> input voxel mapping, computed once for all volumes
+    voxel_map = np.linalg.inv(img.affine) @ affine @ ref.affine
+    resample = lambda volume: ndimage.affine_transform(volume, voxel_map[:3, :3], voxel_map[:3, 3],
+        output_shape=out_shape, output=np.float32, order=1, mode='constant', cval=0.0)
+
+    header = nib.Nifti1Header()
+    header.set_data_shape(out_shape + img.shape[3:])
+    header.set_data_dtype(np.float32)
+    header.set_qform(ref.affine, code='scanner')
+    header.set_sform(ref.affine, code='scanner')
+    header.set_xyzt_units('mm', 'sec')
+    header['pixdim'][4:] = img.header['pixdim'][4:]
+    header['vox_offset'] = header.single_vox_offset
+    with nib.openers.ImageOpener(out_file, 'wb') as f, ThreadPoolExecutor(max_workers=n_workers) as pool:
+        header.write_to(f)
+        f.write(b'\x00' * (header.single_vox_offset - f.tell()))
+        chunk = []
+        for volume in iter_nifti_volumes(in_file):
+            chunk.append(volume)
+            if len(chunk) == chunk_size:
+                for resampled in pool.map(resample, chunk):
+                    f.write(resampled.tobytes(order='F'))
+                chunk = []
+        for resampled in pool.map(resample, chunk):
+            f.write(resampled.tobytes(order='F'))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# description: run subject-specific processing steps as a dependency graph, skipping steps that are up to date
+
+import os
+import json
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass, field
+
+from . import config
+
+@dataclass
+class Step:
+    """
+    A single processing step of the subject-specific pipeline.
+    :name:      step name, used by the `selection` argument of alicpype.tasks
+    :func:      function called with the subject-specific directory (cwd) as its only argument
+    :inputs:    files read by the step, relative to cwd (absolute paths are kept as is)
+    :outputs:   files written by the step, relative to cwd
+    :requires:  names of the steps that must run before this one
+    """
+    name: str
+    func: object
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    requires: list = field(default_factory=list)
+
+def sort_steps(steps):
+    """
+    This function orders steps so that every step comes after the steps it requires.
+    :steps:     list of Step
+
+    :return: list of Step in execution order
+    """
+    by_name = {step.name: step for step in steps}
+    ordered = []
+    visiting = set()
+    def visit(name):
+        if name not in by_name:
+            raise ValueError(f'unknown step {name}')
+        if by_name[name] in ordered:
+            return
+        if name in visiting:
+            raise ValueError(f'dependency cycle at step {name}')
+        visiting.add(name)
+        for required in by_name[name].requires:
+            visit(required)
+        visiting.discard(name)
+        ordered.append(by_name[name])
+    for step in steps:
+        visit(step.name)
+    return ordered
+
+def ancestors(steps, names):
+    """
+    This function returns the requested steps plus every step they (indirectly) require.
+    :steps:     list of Step
+    :names:     names of the requested steps
+
+    :return: set of step names
+    """
+    by_name = {step.name: step for step in steps}
+    found = set()
+    to_visit = list(names)
+    while to_visit:
+        name = to_visit.pop()
+        if name not in by_name:
+            raise ValueError(f'unknown step {name}, available steps are {list(by_name)}')
+        if name not in found:
+            found.add(name)
+            to_visit.extend(by_name[name].requires)
+    return found
+
+# summarize a file so that changes between runs can be detected
+def file_signature(path, method=None):
+    """
+    This function returns a JSON-serializable signature of a file.
+    :path:      file path
+    :method:    'mtime' (size and modification time) or 'hash' (sha256 of the contents), default config.step_signature
+
+    :return: signature, or None if the file doesn't exist
+    """
+    path = Path(path)
+    method = config.step_signature if method is None else method
+    if not path.is_file():
+        return None
+    if method == 'hash':
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+    elif method == 'mtime':
+        stat = path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+    else:
+        raise ValueError(f'unknown signature method {method}')
+
+def load_state(state_file):
+    """
+    This function loads the record of completed steps.
+    :state_file:    path to JSON state file
+    """
+    state_file = Path(state_file)
+    if not state_file.is_file():
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+def save_state(state, state_file):
+    """
+    This function saves the record of completed steps. The file is replaced atomically so that an interrupted
+    run never leaves a truncated record behind.
+    :state:         dict of step name to recorded input signatures
+    :state_file:    path to JSON state file
+    """
+    state_file = Path(state_file)
+    tmp_file = state_file.with_name(state_file.name + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_file, state_file)
+
+def run_steps(steps, cwd, selection=None, method=None):
+    """
+    This function runs processing steps in dependency order.
+    A step is skipped when it completed in a previous run, its inputs are unchanged and all its outputs exist,
+    so an interrupted run resumes at the first incomplete step.
+    :steps:         list of Step
+    :cwd:           path to subject-specific directory
+    :selection:     names of steps to run. Selected steps always run, the steps they require only run if they
+                    are out of date. None runs every step that is out of date.
+    :method:        how inputs are compared between runs, 'mtime' or 'hash', default config.step_signature
+
+    :return: list of names of the steps that ran
+    """
+    cwd = Path(cwd)
+    method = config.step_signature if method is None else method
+    os.makedirs(cwd, exist_ok=True)
+    state_file = cwd / config.pipeline_state_file
+    state = load_state(state_file)
+
+    if isinstance(selection, str):
+        selection = [selection]
+    selected = set() if selection is None else set(selection)
+    to_consider = ancestors(steps, selected) if selection is not None else {step.name for step in steps}
+
+    ran = []
+    for step in sort_steps(steps):
+        if step.name not in to_consider:
+            continue
+        signature = {str(i): file_signature(cwd / i, method) for i in step.inputs}
+        outputs_exist = all((cwd / i).exists() for i in step.outputs)
+        previous = state.get(step.name)
+        if (step.name not in selected and previous is not None
+                and previous['method'] == method and previous['inputs'] == signature and outputs_exist):
+            print(f'step {step.name} is up to date, skipping')
+            continue
+
+        print(f'running step {step.name}')
+        # forget the previous run until this one completes
+        state.pop(step.name, None)
+        save_state(state, state_file)
+        step.func(cwd)
+        state[step.name] = {'method': method, 'inputs': signature}
+        save_state(state, state_file)
+        ran.append(step.name)
+    return ran
@@ -17,11 +17,13 @@ def parse_args():
         description='transforms fiber bundles within 3D Slicer')
     parser.add_argument(
         'infile',
-        help='input fiber bundle in vtk format in native space')
+        nargs='+',
+        help='input fiber bundle(s) in vtk format in native space')
     parser.add_argument(
         '-o', '--output',
+        nargs='+',
         #default=None,
-        help='output fiber bundle in vtk format in transformed space')
+        help='output fiber bundle(s) in vtk format in transformed space, one per input bundle')
     parser.add_argument(
         '-t', '--transform',
         #default=None,
@@ -33,29 +35,62 @@ def parse_args():
         action='store_true',
         help='Keep Slicer open when finished. Default False.'
     )
+    parser.add_argument(
+        '--binary',
+        default=False,
+        action='store_true',
+        help='Save bundles as binary instead of ASCII vtk. Default False.'
+    )
     args = parser.parse_args()
+    if len(args.infile) != len(args.output):
+        parser.error('the number of output bundles must match the number of input bundles')
     #if args.output is None:
         #args.output = os.path.splitext(args.output)[0] + '.mrb'
 
     return args
 
 # transform fiber bundle from ACPC to DTI space
-def transform_fiber_bundle(infile, transform, outfile):
+def transform_fiber_bundle(infile, transform, outfile, binary=False):
     """ 
-    This function transforms csv containing centroids to 3D coordinates
+    This function transforms a fiber bundle from original to transformed space
 
     :infile:                                               input fiber bundle in original space
     :transform:                                            transform file from original to transformed space
     :outfile:                                              output fiber bundle in transformed space
+    :binary:                                               save binary instead of ASCII vtk
+    """
+    transform_fiber_bundles([infile], transform, [outfile], binary)
+
+# transform several fiber bundles from ACPC to DTI space, loading the transform once
+def transform_fiber_bundles(infiles, transform, outfiles, binary=False):
+    """ 
+    This function transforms a list of fiber bundles from original to transformed space
+
+    :infiles:                                              input fiber bundles in original space
+    :transform:                                            transform file from original to transformed space
+    :outfiles:                                             output fiber bundles in transformed space, one per input bundle
+    :binary:                                               save binary instead of ASCII vtk
     """
 
-    print(infile)
     print(transform)
-    print(outfile)
     # load slicer transform (node) from file
     transform_node = slicer.util.loadTransform(transform)
     transform_node.Inverse()
-    
+    for infile, outfile in zip(infiles, outfiles):
+        print(infile)
+        print(outfile)
+        transform_fiber_bundle_with_node(infile, transform_node, outfile, binary)
+
+# transform a fiber bundle with an already loaded transform node
+def transform_fiber_bundle_with_node(infile, transform_node, outfile, binary=False):
+    """ 
+    This function transforms a fiber bundle with a transform node
+
+    :infile:                                               input fiber bundle in original space
+    :transform_node:                                       slicer transform node from original to transformed space
+    :outfile:                                              output fiber bundle in transformed space
+    :binary:                                               save binary instead of ASCII vtk
+    """
     # load and get fiber bundle node
     fiber_node = slicer.util.loadFiberBundle(infile)
     print(fiber_node)
@@ -67,21 +102,24 @@ def transform_fiber_bundle(infile, transform, outfile):
     # harden the transform
     fiber_node.HardenTransform()
 
-    # uncompress node (convert from binary to ascii format)
-    fiber_node.GetStorageNode().SetUseCompression(0)
+    # uncompress node (convert from binary to ascii format) unless binary output is requested
+    fiber_node.GetStorageNode().SetUseCompression(1 if binary else 0)
 
     # save out fiber bundles in transformed space
     slicer.util.saveNode(fiber_node, outfile)
 
+    # remove the bundle so that the next one starts from an empty scene
+    slicer.mrmlScene.RemoveNode(fiber_node)
+
 def main():
     """
-    This function parses command line arguments and passes them to transform_fiber_bundle
+    This function parses command line arguments and passes them to transform_fiber_bundles
 
     """
     exit_status = 0 # doesn't do anything yet. need to catch errors
     args = parse_args()
 
-    transform_fiber_bundle(args.infile, args.transform, args.output)
+    transform_fiber_bundles(args.infile, args.transform, args.output, args.binary)
 
     if not args.stayopen:
         exit(exit_status)
@@ -17,13 +17,15 @@ def parse_args():
         description='transforms centroids using a warpfield within 3D Slicer')
     parser.add_argument(
         'infile',
-        help='input CSV-format file to read. Must contain 3 columns of '
+        nargs='+',
+        help='input CSV-format file(s) to read. Must contain 3 columns of '
             + '(R,A,S) coordinates, with a single header line.')
     parser.add_argument(
         '-o', '--output',
+        nargs='+',
         #default=None,
-        help='Path of CSV-format output file to write. Will be overwritten ' 
-            + 'if it already exists.')
+        help='Path(s) of CSV-format output file(s) to write, one per input file. Will be overwritten ' 
+            + 'if they already exist.')
     parser.add_argument(
         '-t', '--transform',
         #default=None,
@@ -36,6 +38,8 @@ def parse_args():
         help='Keep Slicer open when finished. Default False.'
     )
     args = parser.parse_args()
+    if len(args.infile) != len(args.output):
+        parser.error('the number of output files must match the number of input files')
     #if args.output is None:
         #args.output = os.path.splitext(args.output)[0] + '.mrb'
 
@@ -50,13 +54,35 @@ def transform_points_csv(infile, transform, outfile):
     :transform:                                            transform file from original to transformed space
     :outfile:                                              output csv in transformed space
     """
+    transform_points_csvs([infile], transform, [outfile])
+
+# transform several csvs of centroids from ACPC to MNI space, loading the transform once
+def transform_points_csvs(infiles, transform, outfiles):
+    """ 
+    This function transforms a list of csvs containing centroids to 3D coordinates
+
+    :infiles:                                              input csvs in original space
+    :transform:                                            transform file from original to transformed space
+    :outfiles:                                             output csvs in transformed space, one per input csv
+    """
 
-    print(infile)
     print(transform)
-    print(outfile)
     # load slicer transform (node) from file
     transform_node = slicer.util.loadTransform(transform)
-    
+    for infile, outfile in zip(infiles, outfiles):
+        print(infile)
+        print(outfile)
+        transform_points_with_node(infile, transform_node, outfile)
+
+# transform centroids with an already loaded transform node
+def transform_points_with_node(infile, transform_node, outfile):
+    """ 
+    This function transforms csv containing centroids with a transform node
+
+    :infile:                                               input csv in original space
+    :transform_node:                                       slicer transform node from original to transformed space
+    :outfile:                                              output csv in transformed space
+    """
     # load input csvs in original space
     inputarray = np.loadtxt(str(infile), delimiter=",", skiprows=1, ndmin=2)
     # turn numpy array into fiducial list
@@ -75,15 +101,18 @@ def transform_points_csv(infile, transform, outfile):
     # save transformed array (R,A,S)
     np.savetxt(str(outfile), outputarray, delimiter=",", header="r,a,s")
 
+    # remove the fiducial list so that the next csv starts from an empty scene
+    slicer.mrmlScene.RemoveNode(fiducial_node)
+
 def main():
     """
-    This function parses command line arguments and passes them to transform_points_csv
+    This function parses command line arguments and passes them to transform_points_csvs
 
     """
     exit_status = 0 # doesn't do anything yet. need to catch errors
     args = parse_args()
 
-    transform_points_csv(args.infile, args.transform, args.output)
+    transform_points_csvs(args.infile, args.transform, args.output)
 
     if not args.stayopen:
         exit(exit_status)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# description: read and write streamlines in the formats used by the pipeline
+
+import os
+import json
+import shutil
+import zipfile
+from pathlib import Path
+import numpy as np
+import nibabel as nib
+
+# write streamlines as legacy VTK polydata
+def save_vtk(streams, out_file, binary=False):
+    """
+    This function writes streamlines to a legacy VTK polydata file (3D Slicer compatible). The ASCII output has the
+    same layout as MRtrix tckconvert, the binary output stores big-endian float32 points and int32 connectivity.
+    :streams:   streamlines in world (mm) coordinates
+    :out_file:  output vtk file, overwritten if it already exists
+    :binary:    write binary instead of ASCII data
+    """
+    streams = nib.streamlines.ArraySequence(streams)
+    points = streams.get_data().astype(np.float32)
+    lengths = np.asarray(streams._lengths, dtype=np.int64)
+    n_points = len(points)
+    n_lines = len(lengths)
+
+    with open(out_file, 'wb') as f:
+        f.write(b'# vtk DataFile Version 1.0\n'
+            b'Data values for Tracks\n'
+            + (b'BINARY\n' if binary else b'ASCII\n')
+            + b'DATASET POLYDATA\n')
+        # tckconvert pads the number of points to 10 characters
+        f.write(('POINTS %-10d float\n' % n_points).encode())
+        if binary:
+            f.write(points.astype('>f4').tobytes())
+            f.write(b'\n')
+        else:
+            f.write(''.join('%g %g %g\n' % tuple(p) for p in points.tolist()).encode())
+
+        f.write(('LINES %d %d\n' % (n_lines, n_lines + n_points)).encode())
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        if binary:
+            # each line is stored as its number of points followed by its point indices
+            connectivity = np.empty(n_lines + n_points, dtype='>i4')
+            line_starts = starts + np.arange(n_lines)
+            connectivity[line_starts] = lengths
+            is_index = np.ones(n_lines + n_points, dtype=bool)
+            is_index[line_starts] = False
+            connectivity[is_index] = np.arange(n_points)
+            f.write(connectivity.tobytes())
+            f.write(b'\n')
+        else:
+            for start, length in zip(starts.tolist(), lengths.tolist()):
+                f.write((' '.join(map(str, [length, *range(start, start + length)])) + '\n').encode())
+
+# convert a tck file to vtk without leaving python
+def tck_to_vtk(in_file, out_file=None, binary=False, overwrite=True):
+    """
+    This function converts a tck file to a vtk file with the same base name.
+    :in_file:       input tck file
+    :out_file:      output vtk file (default: in_file with a .vtk suffix)
+    :binary:        write binary instead of ASCII data
+    :overwrite:     overwrite out_file if it already exists
+    """
+    in_file = Path(in_file)
+    assert(in_file.is_file())
+    assert(in_file.suffix.lower() == '.tck')
+    out_file = in_file.with_suffix('.vtk') if out_file is None else Path(out_file)
+    if out_file.exists() and not overwrite:
+        raise FileExistsError(f'{out_file} already exists')
+    save_vtk(nib.streamlines.load(in_file).streamlines, out_file, binary=binary)
+
+# TCK data types (MRtrix 'datatype' header field)
+TCK_DTYPES = {'Float32LE': '<f4', 'Float32BE': '>f4', 'Float64LE': '<f8', 'Float64BE': '>f8'}
+
+def read_tck_header(in_file):
+    """
+    This function reads the text header of a tck file.
+    :in_file:   input tck file
+
+    :return: dict of header field to (string) value
+    """
+    header = {}
+    with open(in_file, 'rb') as f:
+        if f.readline().strip() != b'mrtrix tracks':
+            raise ValueError(f'{in_file} is not a tck file')
+        for line in f:
+            line = line.decode('latin-1').strip()
+            if line == 'END':
+                break
+            key, _, value = line.partition(':')
+            header[key.strip()] = value.strip()
+    return header
+
+def _split_tck_rows(rows, delimiters):
+    """
+    This function converts raw tck rows (points, each streamline followed by a NaN row) into an ArraySequence.
+    :rows:          raw rows
+    :delimiters:    indices of the NaN rows
+    """
+    lengths = np.diff(np.concatenate([[-1], delimiters])) - 1
+    is_point = np.ones(len(rows), dtype=bool)
+    is_point[delimiters] = False
+    streams = nib.streamlines.ArraySequence()
+    streams._data = rows[is_point]
+    streams._offsets = np.cumsum(lengths) - lengths
+    streams._lengths = lengths
+    return streams
+
+def iter_tck_blocks(in_file, block_size=100000, buffer_points=2**20):
+    """
+    This function reads a tck file in blocks of streamlines, so that the memory used is set by the block size and
+    not by the size of the tractogram.
+    :in_file:           input tck file
+    :block_size:        number of streamlines per block (the last block may be smaller)
+    :buffer_points:     number of points read from the file at a time
+
+    :return: generator of ArraySequence (float32 points)
+    """
+    header = read_tck_header(in_file)
+    dtype = np.dtype(TCK_DTYPES[header['datatype']])
+    offset = int(header['file'].split()[1])
+    # chunks of rows read but not yet returned (the first one starting at the beginning of a streamline), with the
+    # indices of their NaN rows, each chunk is only scanned once
+    chunks, delimiters = [], []
+    pending = 0 # number of complete streamlines in chunks
+    end_of_file = False
+    with open(in_file, 'rb') as f:
+        f.seek(offset)
+        while not end_of_file:
+            chunk = np.fromfile(f, dtype=dtype, count=3 * buffer_points)
+            chunk = chunk[:len(chunk) // 3 * 3].reshape(-1, 3).astype(np.float32)
+            # the data ends with a row of infinities
+            terminator = np.flatnonzero(np.isinf(chunk[:, 0]))
+            if len(terminator) > 0:
+                chunk = chunk[:terminator[0]]
+            end_of_file = len(terminator) > 0 or len(chunk) < buffer_points
+            chunks.append(chunk)
+            delimiters.append(np.flatnonzero(np.isnan(chunk[:, 0])))
+            pending += len(delimiters[-1])
+
+            while pending >= block_size or (end_of_file and pending > 0):
+                # last chunk of the block and end of the block within it
+                n_streams = min(block_size, pending)
+                counts = np.cumsum([len(i) for i in delimiters])
+                last = int(np.searchsorted(counts, n_streams))
+                end = delimiters[last][n_streams - (counts[last - 1] if last > 0 else 0) - 1] + 1
+                starts = np.cumsum([0] + [len(i) for i in chunks[:last]])
+                yield _split_tck_rows(np.concatenate(chunks[:last] + [chunks[last][:end]]),
+                    np.concatenate([i + start for i, start in zip(delimiters[:last], starts)]
+                        + [delimiters[last][delimiters[last] < end] + starts[-1]]))
+                # copy the rest so that the rows already returned can be freed
+                chunks = [chunks[last][end:].copy()] + chunks[last + 1:]
+                delimiters = [delimiters[last][delimiters[last] >= end] - end] + delimiters[last + 1:]
+                pending -= n_streams
+    # an unterminated streamline at the end of the file (interrupted tractography) is dropped
+
+class TckWriter:
+    """
+    This class writes a tck file incrementally, one block of streamlines at a time. The streamline count is filled
+    in and the file is moved into place when the writer is closed, so a partial file is never left at out_file.
+    Use as a context manager:
+
+        with TckWriter(out_file) as writer:
+            for block in blocks:
+                writer.append(block)
+    """
+    def __init__(self, out_file):
+        self.out_file = Path(out_file)
+        self.tmp_file = self.out_file.with_name(self.out_file.name + f'.{os.getpid()}.tmp')
+        self.count = 0
+        # fixed width count so that it can be rewritten in place
+        lines = 'mrtrix tracks\ncount: %010d\ndatatype: Float32LE\nfile: . %d\nEND\n'
+        offset = len(lines % (0, 0))
+        while len(lines % (0, offset)) > offset:
+            offset = len(lines % (0, offset))
+        self.file = open(self.tmp_file, 'wb')
+        self.file.write((lines % (0, offset)).encode().ljust(offset, b'\n'))
+        self.count_position = len('mrtrix tracks\ncount: ')
+
+    def append(self, streams):
+        """
+        This function appends streamlines to the file.
+        :streams:   streamlines in world (mm) coordinates
+        """
+        streams = nib.streamlines.ArraySequence(streams)
+        lengths = np.asarray(streams._lengths, dtype=np.int64)
+        if len(lengths) == 0:
+            return
+        # each streamline is followed by a row of NaN
+        rows = np.full((int(lengths.sum()) + len(lengths), 3), np.nan, dtype='<f4')
+        is_point = np.ones(len(rows), dtype=bool)
+        is_point[np.cumsum(lengths + 1) - 1] = False
+        rows[is_point] = np.asarray(streams.get_data()).reshape(-1, 3)
+        self.file.write(rows.tobytes())
+        self.count += len(lengths)
+
+    def close(self):
+        """
+        This function terminates the file, writes the streamline count and moves the file to out_file.
+        """
+        self.file.write(np.full(3, np.inf, dtype='<f4').tobytes())
+        self.file.seek(self.count_position)
+        self.file.write(b'%010d' % self.count)
+        self.file.close()
+        os.replace(self.tmp_file, self.out_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            self.tmp_file.unlink(missing_ok=True)
+
+# columnar, memory-mappable streamline cache
+STREAMS_ARRAYS = ['points', 'offsets', 'lengths']
+# size of the .npy header of the points, fixed so that the shape can be rewritten in place
+NPY_HEADER_SIZE = 128
+
+def _npy_header(shape, dtype):
+    """
+    This function returns a .npy (version 1.0) header of NPY_HEADER_SIZE bytes.
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.dtype(dtype).str, tuple(shape))
+    return b'\x93NUMPY\x01\x00' + np.uint16(NPY_HEADER_SIZE - 10).astype('<u2').tobytes() \
+        + header.ljust(NPY_HEADER_SIZE - 11).encode('latin1') + b'\n'
+
+class StreamsNpyWriter:
+    """
+    This class writes streamlines incrementally, one block at a time, as a directory of .npy arrays (same layout as
+    save_streamlines_npy). The directory is moved into place when the writer is closed, so readers never see a
+    partial cache. Use as a context manager, like TckWriter.
+    """
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir)
+        self.tmp_dir = self.out_dir.with_name(self.out_dir.name + f'.{os.getpid()}.tmp')
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.n_points = 0
+        self.lengths = []
+        self.file = open(self.tmp_dir / 'points.npy', 'wb')
+        self.file.write(_npy_header((0, 3), '<f4'))
+
+    def append(self, streams):
+        """
+        This function appends streamlines to the cache.
+        :streams:   streamlines in world (mm) coordinates
+        """
+        streams = nib.streamlines.ArraySequence(streams)
+        points = np.asarray(streams.get_data(), dtype='<f4').reshape(-1, 3)
+        self.file.write(points.tobytes())
+        self.n_points += len(points)
+        self.lengths.append(np.asarray(streams._lengths, dtype=np.int64))
+
+    def close(self):
+        """
+        This function writes the shape of the points, the offsets and the lengths and moves the cache to out_dir.
+        """
+        self.file.seek(0)
+        self.file.write(_npy_header((self.n_points, 3), '<f4'))
+        self.file.close()
+        lengths = np.concatenate(self.lengths) if self.lengths else np.zeros(0, dtype=np.int64)
+        np.save(self.tmp_dir / 'offsets.npy', np.cumsum(lengths) - lengths)
+        np.save(self.tmp_dir / 'lengths.npy', lengths)
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.out_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+def save_streamlines_npy(streams, out_dir):
+    """
+    This function saves streamlines as a directory of .npy arrays: float32 points (N x 3) and int64 offsets and
+    lengths (one per streamline), which load_streamlines_npy opens without parsing or copying. The directory is
+    replaced atomically, so readers never see a partial cache.
+    :streams:   streamlines in world (mm) coordinates
+    :out_dir:   output directory (ex. combined_aLIC_left_oriented.streams)
+    """
+    with StreamsNpyWriter(out_dir) as writer:
+        writer.append(streams)
+
+def load_streamlines_npy(in_dir, mmap_mode='r'):
+    """
+    This function opens streamlines saved by save_streamlines_npy as an ArraySequence whose arrays are memory maps
+    of the files, so that concurrent readers share the same pages. The memory maps are read-only by default.
+    :in_dir:        directory written by save_streamlines_npy
+    :mmap_mode:     numpy memory-map mode, None to load the arrays in memory
+
+    :return: ArraySequence
+    """
+    in_dir = Path(in_dir)
+    streams = nib.streamlines.ArraySequence()
+    streams._data = np.load(in_dir / 'points.npy', mmap_mode=mmap_mode)
+    streams._offsets = np.load(in_dir / 'offsets.npy', mmap_mode=mmap_mode)
+    streams._lengths = np.load(in_dir / 'lengths.npy', mmap_mode=mmap_mode)
+    return streams
+
+def streamline_point_index(streams, index):
+    """
+    This function returns the indices of all points of a selection of streamlines in the packed points array
+    (streams.get_data(), the order of the points in a saved file).
+    :streams:   ArraySequence
+    :index:     indices of the selected streamlines
+
+    :return: integer array, the points of streams[index] in order
+    """
+    all_lengths = np.asarray(streams._lengths, dtype=np.int64)
+    lengths = all_lengths[index]
+    starts = (np.cumsum(all_lengths) - all_lengths)[index]
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+
+# TRX tractogram (https://github.com/tee-ar-ex/trx-spec): uncompressed zip of a json header and raw arrays
+def save_trx(streams, out_file, ref_img, groups=None, data_per_point=None):
+    """
+    This function writes streamlines once to a TRX file, with named groups of streamlines and per-point data
+    (ex. the coordinates of every point in another space). Members are stored uncompressed so they can be
+    memory-mapped by readers.
+    :streams:           streamlines in world (RAS+ mm) coordinates
+    :out_file:          output trx file
+    :ref_img:           reference image (affine and dimensions of the header)
+    :groups:            dict of group name to indices of the streamlines in the group, default none
+    :data_per_point:    dict of name to N x D (or N) arrays, one row per point, default none
+    """
+    streams = nib.streamlines.ArraySequence(streams)
+    points = np.asarray(streams.get_data(), dtype=np.float32).reshape(-1, 3)
+    lengths = np.asarray(streams._lengths, dtype=np.uint64)
+    # offsets end with the total number of points
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.uint64)
+    header = {'VOXEL_TO_RASMM': np.asarray(ref_img.affine, dtype=float).tolist(),
+        'DIMENSIONS': [int(i) for i in ref_img.shape[:3]],
+        'NB_STREAMLINES': len(lengths),
+        'NB_VERTICES': len(points)}
+
+    members = {'positions.3.float32': points, 'offsets.uint64': offsets}
+    for name, index in ({} if groups is None else groups).items():
+        members[f'groups/{name}.uint32'] = np.asarray(index, dtype=np.uint32)
+    for name, values in ({} if data_per_point is None else data_per_point).items():
+        values = np.asarray(values)
+        if values.ndim == 0 or len(values) != len(points):
+            raise ValueError(f'{name} has {len(values) if values.ndim else 0} rows, expected one per point ({len(points)})')
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        elif values.ndim != 2:
+            raise ValueError(f'{name} must be a N x D array, got shape {values.shape}')
+        members[f'dpv/{name}.{values.shape[1]}.{values.dtype.name}'] = values
+
+    tmp_file = Path(out_file).with_name(Path(out_file).name + f'.{os.getpid()}.tmp')
+    with zipfile.ZipFile(tmp_file, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        zf.writestr('header.json', json.dumps(header))
+        for name, values in members.items():
+            with zf.open(name, 'w', force_zip64=True) as f:
+                f.write(np.ascontiguousarray(values).tobytes())
+    os.replace(tmp_file, out_file)
+
+def _trx_member(trx_file, zf, name):
+    """
+    This function memory-maps an uncompressed member of a TRX file. The dtype and number of columns are taken
+    from the member name (ex. positions.3.float32).
+    """
+    info = zf.getinfo(name)
+    parts = Path(name).name.split('.')
+    dtype = np.dtype(parts[-1])
+    columns = int(parts[-2]) if len(parts) > 2 else 1
+    with open(trx_file, 'rb') as f:
+        # the data follows the local file header (30 bytes, file name and extra field)
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+    offset = info.header_offset + 30 + int(name_length) + int(extra_length)
+    count = info.file_size // dtype.itemsize
+    if count == 0:
+        return np.zeros((0, columns) if columns > 1 else 0, dtype=dtype)
+    values = np.memmap(trx_file, dtype=dtype, mode='r', offset=offset, shape=(count,))
+    return values.reshape(-1, columns) if columns > 1 else values
+
+def load_trx(trx_file, group=None, data_per_point=None):
+    """
+    This function opens the streamlines of a TRX file (memory-mapped), or only those of one group.
+    :trx_file:          trx file written by save_trx
+    :group:             name of the group to load, None for all streamlines
+    :data_per_point:    name of per-point data to return instead of the positions (ex. 'mni')
+
+    :return: ArraySequence
+    """
+    with zipfile.ZipFile(trx_file) as zf:
+        names = zf.namelist()
+        offsets = _trx_member(trx_file, zf, 'offsets.uint64').astype(np.int64)
+        if data_per_point is None:
+            points = _trx_member(trx_file, zf, 'positions.3.float32')
+        else:
+            points = _trx_member(trx_file, zf, next(i for i in names if i.startswith(f'dpv/{data_per_point}.')))
+        index = None if group is None else _trx_member(trx_file, zf, f'groups/{group}.uint32')
+    streams = nib.streamlines.ArraySequence()
+    streams._data = points
+    streams._offsets = offsets[:-1]
+    streams._lengths = np.diff(offsets)
+    return streams if index is None else streams[index.astype(np.intp)]
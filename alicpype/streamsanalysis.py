@@ -31,6 +31,7 @@ from dipy.tracking.utils import density_map
 # alicpype imports
 from . import config
 from .config import targetLabels
+from .ocdprofile import load_ocd_profile, slice_table
 
 # load Freesurfer labels
 lookupTable=config.freesurfer_lookup_table
@@ -50,7 +51,11 @@ def run_streamline_analysis(data_dir, subject_list):
         
         for iSubject in subject_list: #iterate over subjects
             inputcsvpath = data_dir / iSubject / 'OCD_pipeline' / 'output' / f'{iSlice}_OCD_response_tract_streams.csv'
-            inputcsv = np.loadtxt(inputcsvpath, delimiter=",", skiprows=1, dtype=str)
+            if inputcsvpath.is_file():
+                inputcsv = np.loadtxt(inputcsvpath, delimiter=",", skiprows=1, dtype=str)
+            else:
+                # table of a slice that was not written by subsegment_alic, from the subject's overlap profile
+                inputcsv = slice_table(load_ocd_profile(inputcsvpath.parent / config.ocd_profile_file), iSlice).to_numpy()
             #table = table.append({'subject': iSubject}, ignore_index=True, ) #for iSubject append subjectID in subject columnn of table
             for iRow in inputcsv: 
                 number_data[iRow[0]][iSubject] = iRow[1]
@@ -13,9 +13,10 @@ from scipy import ndimage
 from . import config
 from subprocess import run
 from tempfile import NamedTemporaryFile
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
 #import random
 
-import pandas as pd
 import wmaPyTools.roiTools
 import wmaPyTools.analysisTools
 import wmaPyTools.segmentationTools
@@ -28,9 +29,18 @@ from dipy.tracking import utils
 from dipy.tracking.utils import density_map
 
 from .config import targetLabels
+from .heatmap import points_to_voxels, rasterize_streamlines, density_from_rasterized, save_density_volume
+from .streamlineio import save_vtk, save_streamlines_npy, load_streamlines_npy, save_trx, streamline_point_index
+from .streamlineio import iter_tck_blocks, TckWriter, StreamsNpyWriter
+from .containers import resolve_image
+from .labelio import load_labels, load_mask, labels_image, save_labels
+from .registration import load_fsl_warp, warp_streamlines
+from .planecrossing import streams_crossing_planes
+from .ocdprofile import profile_planes, save_ocd_profile, save_slice_tables
+from .xfmcache import convert_transform
 import nipype.interfaces.fsl as fsl
 
-# Convert tck to vtk
+# Convert tck to vtk with MRtrix tckconvert (superseded by streamlineio.save_vtk, see config.vtk_writer)
 def tck2vtk(in_file, overwrite=True):
     """ 
     This function converts a tck file to a vtk
@@ -44,7 +54,7 @@ def tck2vtk(in_file, overwrite=True):
 
     # make sure to set $APPTAINER_BIND before running. for instance:
     # export APPTAINER_BIND=/home,${APPTAINER_BIND}
-    cmd = ['apptainer', 'exec', 'docker://brainlife/mrtrix3:3.0.0',
+    cmd = ['apptainer', 'exec', resolve_image(config.mrtrix_image),
 		'tckconvert', str(in_file), str(out_file)]
 
     if overwrite:
@@ -95,10 +105,9 @@ def ocd_response_tract_roi(input_roi, coronal_slice, dimension = 'y', threshold
     """
     input_roi_nifti = nib.load(input_roi)
     planar_roi = wmaPyTools.roiTools.makePlanarROI(input_roi_nifti, coronal_slice, dimension)
-    planar_data = planar_roi.get_fdata()
-    target_data = input_roi_nifti.get_fdata() >= threshold #binarizes mask for ocd response tract
-    planar_data = planar_data * target_data
-    return nib.Nifti1Image(planar_data, input_roi_nifti.affine, input_roi_nifti.header)
+    planar_data = load_mask(planar_roi, 0)
+    target_data = np.asanyarray(input_roi_nifti.dataobj) >= threshold #binarizes mask for ocd response tract
+    return labels_image(planar_data & target_data, input_roi_nifti)
 
 # calculate the number of streamlines and percent streamlines overlapping with OCD response tract ROI
 def calculate_streams_ocd_response(input_streams, planar_roi):
@@ -129,6 +138,38 @@ def get_streams_matching_target(streams, atlas, target):
                     [True,], 
                     ['either_end',]) 
 
+# look up the atlas label at both endpoints of every streamline
+def get_endpoint_labels(streams, atlas, labels=None):
+    """ 
+    This function looks up the atlas labels of the first and last point of every streamline in a single pass
+    :streams:   input streamlines
+    :atlas:     DK atlas
+    :labels:    optional labels of the atlas (load_labels), avoids reloading them for every block of streamlines
+
+    :return: (start_labels, end_labels) integer arrays with one entry per streamline (0 outside the atlas)
+    """
+    streams = nib.streamlines.ArraySequence(streams)
+    labels = load_labels(atlas) if labels is None else labels
+    endpoint_labels = []
+    for point_index in [streams._offsets, streams._offsets + streams._lengths - 1]:
+        voxels = points_to_voxels(streams._data[point_index], atlas.affine)
+        inside = np.all((voxels >= 0) & (voxels < labels.shape[:3]), axis=1)
+        endpoint_label = np.zeros(len(voxels), dtype=labels.dtype)
+        endpoint_label[inside] = labels[tuple(voxels[inside].T)]
+        endpoint_labels.append(endpoint_label)
+    return tuple(endpoint_labels)
+
+# get streamlines for prefrontal cortical target from precomputed endpoint labels
+def get_streams_matching_target_labels(endpoint_labels, target):
+    """ 
+    This function gets the streamlines ending in a prefrontal cortical target from the labels of their endpoints
+    :endpoint_labels:   (start_labels, end_labels) from get_endpoint_labels
+    :target:            PFC target label, or list of labels
+    """
+    target = np.atleast_1d(target)
+    # return boolean mask for stream selection
+    return np.isin(endpoint_labels[0], target) | np.isin(endpoint_labels[1], target)
+
 # save out density map
 def save_density_map(streams, ref_img, out_file):
     """
@@ -138,39 +179,68 @@ def save_density_map(streams, ref_img, out_file):
     out_file:   density map nifti for PFC target
     """
     density=utils.density_map(streams, ref_img.affine, ref_img.shape)
-    densityNifti = nib.nifti1.Nifti1Image(density, ref_img.affine, ref_img.header)
-    nib.save(densityNifti, out_file)
+    save_density_volume(density, ref_img, out_file)
     
 # save out streamlines for each prefrontal cortical target
-def save_streams_matching_target(streams, atlas, lookupTable, target, out_file):
+def save_streams_matching_target(streams, atlas, lookupTable, target, out_file, endpoint_labels=None, rasterized=None):
     """
     This function saves streamlines for each PFC target in tck and vtk format and pass through save_density_map.
-    streams:        input streamlines from PFC target
-    atlas:          DK atlas
-    lookupTable:    freesurfer lookup table
-    target:         PFC target label
-    out_file:       tck and vtk of streamlines from PFC target
+    streams:            input streamlines from PFC target
+    atlas:              DK atlas
+    lookupTable:        freesurfer lookup table
+    target:             PFC target label
+    out_file:           tck and vtk of streamlines from PFC target
+    endpoint_labels:    optional endpoint labels of streams (get_endpoint_labels), avoids a full segmentation pass per target
+    rasterized:         optional rasterized streams (heatmap.rasterize_streamlines), density map is built from it instead of re-rasterizing
+
+    return: (boolean vector of streams matching the target, indices of the saved streams after culling)
     """
     strTarget = lookupTable.loc[target, 'LabelName:']
     print('target label is: %s (%s)' % (target, strTarget))
     print(out_file)
     # get boolean vector of matching streams
-    targetBool = get_streams_matching_target(streams, atlas, target)
-    streams = streams[targetBool]
-        
+    if endpoint_labels is None:
+        targetBool = get_streams_matching_target(streams, atlas, target)
+    else:
+        targetBool = get_streams_matching_target_labels(endpoint_labels, target)
+    # keep track of the indices of the selected streams within the input streams
+    target_index = np.flatnonzero(targetBool)
+    surviving = save_target_streams(streams[targetBool], atlas, out_file, rasterized, target_index)
+    return targetBool, target_index[surviving]
+
+# cull and save out the streamlines of a prefrontal cortical target
+def save_target_streams(streams, atlas, out_file, rasterized=None, target_index=None):
+    """
+    This function culls the streamlines of a PFC target and saves them in tck and vtk format with their density map.
+    streams:        streamlines of the PFC target
+    atlas:          DK atlas
+    out_file:       tck and vtk of streamlines from PFC target
+    rasterized:     optional rasterized parent streams (heatmap.rasterize_streamlines), density map is built from it
+    target_index:   indices of streams within the rasterized parent streams (required with rasterized)
+
+    return: indices of the saved streams within streams
+    """
+    surviving = np.arange(len(streams))
     #dipy quickbundles, will only run if > 0 streamlines present
     if len(streams) > 0:
-        streams = streams[bundle(streams)]
+        surviving = np.flatnonzero(bundle(streams))
+        streams = streams[surviving]
         
     #save *.tck tractogram
     wmaPyTools.streamlineTools.stubbornSaveTractogram(streams,
         savePath=str(out_file.with_suffix('.tck')))
     # save nifti density map
-    save_density_map(streams, atlas, out_file.with_suffix('.nii.gz'))
+    if rasterized is None:
+        save_density_map(streams, atlas, out_file.with_suffix('.nii.gz'))
+    else:
+        save_density_volume(density_from_rasterized(rasterized, atlas.shape, target_index[surviving]), atlas, out_file.with_suffix('.nii.gz'))
 
     # convert tcks to vtks
-    tck2vtk(out_file.with_suffix('.tck'))
-    return targetBool
+    if config.vtk_writer == 'native':
+        save_vtk(streams, out_file.with_suffix('.vtk'), binary=config.vtk_binary)
+    else:
+        tck2vtk(out_file.with_suffix('.tck'))
+    return surviving
 
 # apply the initial culling, to remove extraneous streamlines 
 # first requires doing a DIPY quickbundling
@@ -194,14 +264,222 @@ def bundle(streams):
         
     return survivingStreamsBoolVec
 
+# split a tractogram by target one block of streamlines at a time
+def split_targets_streaming(blocks, atlas, candidate_files, density_file, oriented_file=None):
+    """
+    This function sorts the streamlines of a tractogram into one tck file per PFC target (streamlines with an endpoint
+    in the target) without holding the tractogram in memory: memory use is set by the size of the blocks.
+    :blocks:            iterable of blocks of streamlines (ex. streamlineio.iter_tck_blocks)
+    :atlas:             DK atlas
+    :candidate_files:   dict of PFC target label to output tck file
+    :density_file:      output density map of the whole tractogram
+    :oriented_file:     orient the streamlines of every block and save them to this tck file or .streams directory
+                        (save_streamlines_npy layout), None if the blocks are already oriented
+    """
+    labels = load_labels(atlas)
+    density = np.zeros(atlas.shape[:3], dtype=np.uint32)
+    with ExitStack() as stack:
+        writers = {target: stack.enter_context(TckWriter(out_file)) for target, out_file in candidate_files.items()}
+        oriented_writer = None
+        if oriented_file is not None:
+            oriented_writer = stack.enter_context(
+                StreamsNpyWriter(oriented_file) if Path(oriented_file).suffix == '.streams' else TckWriter(oriented_file))
+        for block in blocks:
+            if oriented_writer is not None:
+                block = nib.streamlines.ArraySequence(wmaPyTools.streamlineTools.orientAllStreamlines(block))
+                oriented_writer.append(block)
+            density += density_from_rasterized(rasterize_streamlines(block, atlas.affine, atlas.shape), atlas.shape).astype(np.uint32)
+            endpoint_labels = get_endpoint_labels(block, atlas, labels)
+            for target, writer in writers.items():
+                writer.append(block[get_streams_matching_target_labels(endpoint_labels, target)])
+    save_density_volume(density, atlas, density_file)
+
 # SUBSEGMENT TRACKS
 
-def subsegment_alic(cwd):
+def subsegment_side(cwd, iSide, inflated_atlas_file, mni_to_acpc_xfm_mrtrix, ROI_list,
+        endpoint_lookup=None, rasterize_density=None, native_warp=None, block_size=None):
+    """ 
+    This function runs anatomical-based segmentation on the ALIC tractogram(s) of a single hemisphere
+    :cwd:                       path to subject-specific processed data
+    :iSide:                     hemisphere ('left' or 'right')
+    :inflated_atlas_file:       inflated & deIslanded parcellation, read-only
+    :mni_to_acpc_xfm_mrtrix:    MRtrix-format transform used to bring tcks from acpc to MNI (unused with native_warp)
+    :ROI_list:                  dict of coronal slice (mm) to OCD response tract planar ROI, used instead of the
+                                crossing test at these slices ('roi' backend, None with the 'crossing' backend)
+    :endpoint_lookup:           label the endpoints of all streamlines once instead of segmenting once per target,
+                                default config.subsegment_endpoint_lookup
+    :rasterize_density:         rasterize the streamlines once and build every density map from the rasterized voxels,
+                                default config.subsegment_rasterize_density
+    :native_warp:               warp the target streamlines to MNI in-process instead of with tcktransform, default
+                                config.native_streamline_warp
+    :block_size:                stream the tractogram in blocks of this many streamlines (0: load it whole), default
+                                config.subsegment_block_size
+
+    :return: (target names, coronal slices (mm), number of streamlines crossing the OCD response tract at every slice
+             (targets x slices), number of streamlines overlapping the planar ROIs (targets x ROI_list slices),
+             number of streamlines of every target)
+    """
+    cwd = Path(cwd)
+    endpoint_lookup = config.subsegment_endpoint_lookup if endpoint_lookup is None else endpoint_lookup
+    rasterize_density = config.subsegment_rasterize_density if rasterize_density is None else rasterize_density
+    native_warp = config.native_streamline_warp if native_warp is None else native_warp
+    block_size = config.subsegment_block_size if block_size is None else block_size
+    track_files = [cwd / i for i in config.track_files[iSide]]
+
+    # load Freesurfer labels and the inflated atlas
+    lookupTable=config.freesurfer_lookup_table
+    inflatedAtlas=nib.load(inflated_atlas_file)
+
+    # load the fsl-format warp once, the inverse xfm (mni_to_acpc_xfm) maps points and tcks from acpc to mni
+    # (same reference image as the MRtrix-format conversion in subsegment_alic)
+    if native_warp:
+        mni_to_acpc_warp = load_fsl_warp(cwd / config.mni_to_acpc_xfm, cwd / config.parcellationPath)
+
+    # OCD response tract, tested at the crossings of every target bundle with all the planes of the profile
+    response_tract = nib.load(cwd / config.ocd_response_tract_MNI)
+    response_mask = np.asanyarray(response_tract.dataobj) >= 1 # same threshold as ocd_response_tract_roi
+    planes = profile_planes()
+
+    target_names, counts, roi_counts, n_streamlines = [], [], [], []
+    for track_file in track_files:
+
+        # load & orient streamlines
+            
+        tck_oriented_file = cwd / config.saveFigDir / Path(track_file.stem + '_oriented').with_suffix('.tck')
+        npy_oriented_dir = cwd / config.saveFigDir / Path(track_file.stem + '_oriented').with_suffix('.streams')
+        parent_density_file = cwd / config.saveFigDir / Path(track_file.stem).with_suffix('.nii.gz')
+        if block_size:
+            # only the streamlines of one target at a time are loaded, from per-target candidate files
+            candidate_files = {iTarget: cwd / config.saveFigDir / ('%s_%04d_candidates.tck' % (track_file.stem, iTarget))
+                for iTarget in targetLabels[iSide]}
+            oriented_file = None
+            if npy_oriented_dir.is_dir():
+                print('oriented streamlines already exist. streaming %s' % npy_oriented_dir)
+                streams = load_streamlines_npy(npy_oriented_dir)
+                blocks = (streams[i:i + block_size] for i in range(0, len(streams), block_size))
+            elif tck_oriented_file.exists():
+                print('oriented tck already exists. streaming %s' % tck_oriented_file)
+                blocks = iter_tck_blocks(tck_oriented_file, block_size)
+            else:
+                print('streaming and orienting tck %s' % track_file)
+                blocks = iter_tck_blocks(track_file, block_size)
+                oriented_file = npy_oriented_dir if config.oriented_cache_format == 'npy' else tck_oriented_file
+            print('saving density map %s' % parent_density_file)
+            split_targets_streaming(blocks, inflatedAtlas, candidate_files, parent_density_file, oriented_file)
+        else:
+            if config.oriented_cache_format == 'npy' and npy_oriented_dir.is_dir():
+                print('oriented streamlines already exist. memory-mapping %s' % npy_oriented_dir)
+                streams = load_streamlines_npy(npy_oriented_dir)
+            elif tck_oriented_file.exists():
+                print('oriented tck already exists. loading %s' % tck_oriented_file)
+                tckIn=nib.streamlines.load(tck_oriented_file)
+                streams = tckIn.streamlines
+                if config.oriented_cache_format == 'npy':
+                    # convert the cache of an earlier run once
+                    save_streamlines_npy(streams, npy_oriented_dir)
+                    streams = load_streamlines_npy(npy_oriented_dir)
+            else:
+                print('Load tck %s' % track_file)
+                tckIn=nib.streamlines.load(track_file)
+                print("orienting streamlines")
+                streams=wmaPyTools.streamlineTools.orientAllStreamlines(tckIn.streamlines)
+                # do quickbundles (never mind, takes too long)
+                # save oriented + bundled streams
+                if config.oriented_cache_format == 'npy':
+                    print('saving oriented streamlines %s' % npy_oriented_dir)
+                    save_streamlines_npy(streams, npy_oriented_dir)
+                    streams = load_streamlines_npy(npy_oriented_dir) # share pages with the cache from now on
+                else:
+                    print('saving oriented tck %s' % tck_oriented_file)
+                    wmaPyTools.streamlineTools.stubbornSaveTractogram(streams,savePath=str(tck_oriented_file))
+            
+            print('saving density map %s' % parent_density_file)
+            if rasterize_density:
+                rasterized = rasterize_streamlines(streams, inflatedAtlas.affine, inflatedAtlas.shape)
+                save_density_volume(density_from_rasterized(rasterized, inflatedAtlas.shape), inflatedAtlas, parent_density_file)
+            else:
+                rasterized = None
+                save_density_map(streams, inflatedAtlas, parent_density_file)
+
+            # calculate whole ALIC streamlines that overlap with OCD response tract
+            #response_tract = nib.load(cwd / config.ocd_response_tract_acpc)
+
+            # atlas labels at both ends of every streamline, shared by all targets
+            endpoint_labels = get_endpoint_labels(streams, inflatedAtlas) if endpoint_lookup else None
+
+        # targets as groups of a single trx file of the parent streamlines, with their MNI coordinates
+        save_side_trx = config.save_trx and not block_size
+        if config.save_trx and block_size:
+            warn('save_trx needs the whole tractogram in memory, no trx file is written with subsegment_block_size')
+        if save_side_trx:
+            trx_groups = {}
+            trx_mni = np.full((int(np.sum(streams._lengths)), 3), np.nan, dtype=np.float32)
+
+        for iTarget in targetLabels[iSide]:
+            targetStr = lookupTable.loc[iTarget, 'LabelName:']
+            out_file = cwd / config.saveFigDir / ('%s_%04d_%s' % (track_file.stem, iTarget, targetStr))
+            print('Starting processing for %s' % out_file.stem)
+                
+            # subsegment the streams and save the resulting density map and tck tractogram
+            if block_size:
+                target_streams = nib.streamlines.load(candidate_files[iTarget]).streamlines
+                target_index = save_target_streams(target_streams, inflatedAtlas, out_file)
+                os.remove(candidate_files[iTarget])
+            else:
+                target_streams = streams
+                targetBool, target_index = save_streams_matching_target(streams, inflatedAtlas, lookupTable, iTarget, out_file, endpoint_labels, rasterized)
+
+            # transform tck from acpc to MNI space
+            output_tck_mni_path = cwd / config.saveFigDir / f'{out_file.stem}_mni.tck'
+            if native_warp:
+                tck_mni = warp_streamlines(target_streams[target_index], mni_to_acpc_warp)
+                if config.save_mni_tck:
+                    wmaPyTools.streamlineTools.stubbornSaveTractogram(tck_mni, savePath=str(output_tck_mni_path))
+            else:
+                tck_mni = apply_mrtrix_xfm(out_file.with_suffix('.tck'), output_tck_mni_path, mni_to_acpc_xfm_mrtrix) #we must use the inverse xfm for transfomring points and tcks
+
+            # calculate the number of streamlines and percent streamlines for each target that overlap with OCD response tract
+            counts.append(streams_crossing_planes(tck_mni, planes, response_mask, response_tract.affine, axis=1).sum(axis=1))
+            if ROI_list is not None:
+                #iROI is the mm slice, value is the nifti at that specific mm slice
+                roi_counts.append([calculate_streams_ocd_response(tck_mni, value)[0] for (iROI, value) in ROI_list.items()])
+            target_names.append(targetStr)
+            n_streamlines.append(len(tck_mni))
+
+            if save_side_trx:
+                trx_groups['%04d_%s' % (iTarget, targetStr)] = target_index
+                trx_mni[streamline_point_index(streams, target_index)] = np.asarray(tck_mni.get_data()).reshape(-1, 3)
+
+        if save_side_trx:
+            trx_file = cwd / config.saveFigDir / Path(track_file.stem).with_suffix('.trx')
+            print('saving %s' % trx_file)
+            save_trx(streams, trx_file, inflatedAtlas, trx_groups, {'mni': trx_mni})
+    n_roi = 0 if ROI_list is None else len(ROI_list)
+    return (target_names, planes, np.reshape(counts, (len(target_names), len(planes))),
+        np.reshape(roi_counts, (len(target_names), n_roi)), n_streamlines)
+
+def subsegment_alic(cwd, parallel_sides=None, endpoint_lookup=None, rasterize_density=None, native_warp=None,
+        block_size=None):
     """ 
     This function runs anatomical-based segmentation on the whole ALIC tractogram
-    :cwd:   path to subject-specific processed data
+    :cwd:               path to subject-specific processed data
+    :parallel_sides:    process the left and right hemispheres concurrently in separate processes, default
+                        config.subsegment_parallel_sides
+    :endpoint_lookup:   label the endpoints of all streamlines once instead of segmenting once per target, default
+                        config.subsegment_endpoint_lookup
+    :rasterize_density: rasterize the streamlines once and build every density map from the rasterized voxels,
+                        default config.subsegment_rasterize_density
+    :native_warp:       warp the target streamlines to MNI in-process instead of converting the warps for tcktransform,
+                        default config.native_streamline_warp
+    :block_size:        stream the tractograms in blocks of this many streamlines instead of loading them whole (0),
+                        default config.subsegment_block_size
     """
     cwd = Path(cwd)
+    parallel_sides = config.subsegment_parallel_sides if parallel_sides is None else parallel_sides
+    endpoint_lookup = config.subsegment_endpoint_lookup if endpoint_lookup is None else endpoint_lookup
+    rasterize_density = config.subsegment_rasterize_density if rasterize_density is None else rasterize_density
+    native_warp = config.native_streamline_warp if native_warp is None else native_warp
+    block_size = config.subsegment_block_size if block_size is None else block_size
 
     # paths to input data
     track_files = {k: [cwd / i for i in v]
@@ -222,77 +500,48 @@ def subsegment_alic(cwd):
     # load atlas-based segmentation - modified rACC mask
     parcellaton=nib.load( cwd / config.rACC_mod_aparc_aseg)
 
-    # load Freesurfer labels
-    lookupTable=config.freesurfer_lookup_table
-
     # perform inflate & deIsland of input parcellation
     inflated_atlas_file = cwd / config.saveFigDir / Path(Path(cwd / config.rACC_mod_aparc_aseg.stem).stem + '_inflated').with_suffix('.nii.gz')
     print(inflated_atlas_file)
     inflatedAtlas,deIslandReport,inflationReport= wmaPyTools.roiTools.preProcParc(parcellaton,deIslandBool=True,inflateIter=2,retainOrigBorders=False,maintainIslandsLabels=None,erodeLabels=[2,41])    
-    nib.save(inflatedAtlas,filename=inflated_atlas_file)
+    save_labels(load_labels(inflatedAtlas), inflatedAtlas, inflated_atlas_file) # stored as int16 rather than float
 
-    # convert fsl-format acpc to MNI xfm to mrtrix format
+    # convert fsl-format acpc to MNI xfm to mrtrix format (not needed when the fsl-format warp is applied in-process)
     acpc_to_mni_xfm_mrtrix = cwd / config.data_dir / 'acpc_to_mni_xfm_mrtrix.nii.gz'
     mni_to_acpc_xfm_mrtrix = cwd / config.data_dir / 'mni_to_acpc_xfm_mrtrix.nii.gz'
-    convert_xfm_fsl_to_mrtrix(cwd / config.acpc_to_mni_xfm, acpc_to_mni_xfm_mrtrix, cwd / config.MNI_ref_image) #use original xfm (acpc_to_mni_xfm) to transform images from acpc to mni
-    convert_xfm_fsl_to_mrtrix(cwd / config.mni_to_acpc_xfm, mni_to_acpc_xfm_mrtrix, cwd / config.parcellationPath) #use inverse xfm (mni_to_acpc_xfm) to transform centroids or tcks from acpc to mni
+    if not native_warp:
+        convert_transform(cwd / config.acpc_to_mni_xfm, acpc_to_mni_xfm_mrtrix, cwd / config.MNI_ref_image, 'mrtrix', convert_xfm_fsl_to_mrtrix) #use original xfm (acpc_to_mni_xfm) to transform images from acpc to mni
+        convert_transform(cwd / config.mni_to_acpc_xfm, mni_to_acpc_xfm_mrtrix, cwd / config.parcellationPath, 'mrtrix', convert_xfm_fsl_to_mrtrix) #use inverse xfm (mni_to_acpc_xfm) to transform centroids or tcks from acpc to mni
 
-    # generate OCD response tract ROI
-    ROI_list = {}
-    for iSlice in config.coronal_slices_displayed_mm:
-        ROI_list[iSlice] = ocd_response_tract_roi(cwd / config.ocd_response_tract_MNI, iSlice, dimension = "y")
-
-    # create an table for streamline data
-    column_labels = ['target', 'number_of_streamlines', 'percent_streamlines']
-    tables = {key: pd.DataFrame(columns=column_labels) for key in ROI_list.keys()}
+    # generate OCD response tract ROI of the displayed slices (the 'crossing' backend uses the OCD response tract directly)
+    ROI_list = None
+    if config.ocd_response_backend != 'crossing':
+        ROI_list = {}
+        for iSlice in config.coronal_slices_displayed_mm:
+            ROI_list[iSlice] = ocd_response_tract_roi(cwd / config.ocd_response_tract_MNI, iSlice, dimension = "y")
 
     # Main cell, do all the hard work
+    # the hemispheres only share the (read-only) inflated atlas and the ROIs, so they can run in separate processes
+    side_args = (inflated_atlas_file, mni_to_acpc_xfm_mrtrix, ROI_list, endpoint_lookup, rasterize_density, native_warp, block_size)
+    if parallel_sides:
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            futures = {iSide: pool.submit(subsegment_side, cwd, iSide, *side_args) for iSide in ['left', 'right']}
+            side_results = {iSide: future.result() for iSide, future in futures.items()}
+    else:
+        side_results = {iSide: subsegment_side(cwd, iSide, *side_args) for iSide in ['left', 'right']}
+
+    # save out the overlap profile of all targets (targets x coronal slices) for a single subject
+    target_names, planes, counts, roi_counts, n_streamlines = [], None, [], [], []
     for iSide in ['left', 'right']:
-        for track_file in track_files[iSide]:
-
-            # load & orient streamlines
-                
-            tck_oriented_file = cwd / config.saveFigDir / Path(track_file.stem + '_oriented').with_suffix('.tck')
-            if tck_oriented_file.exists():
-                print('oriented tck already exists. loading %s' % tck_oriented_file)
-                tckIn=nib.streamlines.load(tck_oriented_file)
-                streams = tckIn.streamlines
-            else:
-                print('Load tck %s' % track_file)
-                tckIn=nib.streamlines.load(track_file)
-                print("orienting streamlines")
-                streams=wmaPyTools.streamlineTools.orientAllStreamlines(tckIn.streamlines)
-                # do quickbundles (never mind, takes too long)
-                # save oriented + bundled streams
-                print('saving oriented tck %s' % tck_oriented_file)
-                wmaPyTools.streamlineTools.stubbornSaveTractogram(streams,savePath=str(tck_oriented_file))
-                
-            parent_density_file = cwd / config.saveFigDir / Path(track_file.stem).with_suffix('.nii.gz')
-            print('saving density map %s' % parent_density_file)
-            save_density_map(streams, inflatedAtlas, parent_density_file)
+        side_targets, planes, side_counts, side_roi_counts, side_streamlines = side_results[iSide]
+        target_names += side_targets
+        counts.append(side_counts)
+        roi_counts.append(side_roi_counts)
+        n_streamlines += side_streamlines
+    roi_slices = [] if ROI_list is None else list(ROI_list.keys())
+    profile_file = cwd / config.saveFigDir / config.ocd_profile_file
+    save_ocd_profile(profile_file, target_names, planes, np.concatenate(counts), n_streamlines,
+        roi_slices, np.concatenate(roi_counts))
 
-            # calculate whole ALIC streamlines that overlap with OCD response tract
-            #response_tract = nib.load(cwd / config.ocd_response_tract_acpc)
-
-            for iTarget in targetLabels[iSide]:
-                targetStr = lookupTable.loc[iTarget, 'LabelName:']
-                out_file = cwd / config.saveFigDir / ('%s_%04d_%s' % (track_file.stem, iTarget, targetStr))
-                print('Starting processing for %s' % out_file.stem)
-                    
-                # subsegment the streams and save the resulting density map and tck tractogram
-                targetBool = save_streams_matching_target(streams, inflatedAtlas, lookupTable, iTarget, out_file,)
-
-                # transform tck from acpc to MNI space
-                output_tck_mni_path = cwd / config.saveFigDir / f'{out_file.stem}_mni.tck'
-                tck_mni = apply_mrtrix_xfm(out_file.with_suffix('.tck'), output_tck_mni_path, mni_to_acpc_xfm_mrtrix) #we must use the inverse xfm for transfomring points and tcks
-
-                # calculate the number of streamlines and percent streamlines for each target that overlap with OCD response tract
-                for (iROI, value) in ROI_list.items(): #iROI is the mm slice, value is the nifti at that specific mm slice
-                    tables[iROI].loc[targetStr] = [targetStr, *calculate_streams_ocd_response(tck_mni, value)]
-        
     # save out streamline csv containging all targets for a particularly slice for a single subject 
-    for (iROI, value) in tables.items():
-        outfile = cwd / config.saveFigDir / f'{iROI}_OCD_response_tract_streams.csv'
-        value.to_csv(outfile, index=False)
-
-
+    save_slice_tables(profile_file, cwd / config.saveFigDir, config.coronal_slices_displayed_mm)
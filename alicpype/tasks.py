@@ -3,111 +3,189 @@
 
 from pathlib import Path
 
+from . import config
+from .scheduler import Step, run_steps
+
 # importing function from each script/submodules (ex. centroids.py)
 from .externalio import import_hcp_subject, import_7T_hcp_subject, import_ocd_subject
+from .externalio import hcp_subject_files, hcp_7T_subject_files, ocd_subject_files, ocd_subject_dir
 from .tractography import generate_alic
 from .splitracc import split_racc
 from .subsegment import subsegment_alic
 from .centroids import generate_centroid
 from .centroids import transform_bundles
 
+# per-target output files of subsegment_alic
+def target_files(suffix):
+    """
+    This function lists a per-target output file of every PFC target in both hemispheres.
+    :suffix:    ending of the file name after the target label (ex. '.nii.gz')
+    """
+    files = []
+    for iSide in ['left', 'right']:
+        for track_file in config.track_files[iSide]:
+            for iTarget in config.targetLabels[iSide]:
+                targetStr = config.freesurfer_lookup_table.loc[iTarget, 'LabelName:']
+                files.append(config.saveFigDir / ('%s_%04d_%s%s' % (track_file.stem, iTarget, targetStr, suffix)))
+    return files
+
+# import step shared by all pipelines
+def import_step(name, func, source_dir, files, extra_outputs=[]):
+    """
+    This function describes the step that copies a subject's inputs into cwd.
+    :name:              step name
+    :func:              import function called as func(cwd)
+    :source_dir:        subject-specific directory where data will be copied from
+    :files:             dict of [source path, destination path] imported (see externalio)
+    :extra_outputs:     files derived from the imported files by the import function
+    """
+    return Step(name, func,
+        inputs=[Path(source_dir) / source_file for source_file, dest_file in files.values()],
+        outputs=[dest_file for source_file, dest_file in files.values()] + extra_outputs)
+
+# processing steps shared by all pipelines after the import step
+def alic_steps(import_name):
+    """
+    This function describes the tractography, rACC split and subsegmentation steps.
+    :import_name:   name of the step importing the subject's inputs
+    """
+    track_files = [i for side in ['left', 'right'] for i in config.track_files[side]]
+    return [
+        Step('generate_alic', generate_alic,
+            inputs=[config.parcellationPath, config.parcellationFsPath, config.refT1Path,
+                config.diffPath, config.bvalsPath, config.bvecsPath],
+            outputs=[*track_files, *config.alic_mask_files.values()],
+            requires=[import_name]),
+        Step('split_racc', split_racc,
+            inputs=[config.parcellationPath, config.mni_to_acpc_xfm, config.splitraccplane],
+            outputs=[config.rACC_mod_aparc_aseg],
+            requires=[import_name]),
+        Step('subsegment_alic', subsegment_alic,
+            inputs=[*track_files, config.rACC_mod_aparc_aseg, config.parcellationPath, config.refT1Path,
+                config.acpc_to_mni_xfm, config.mni_to_acpc_xfm, config.ocd_response_tract_MNI],
+            outputs=[*target_files('.tck'), *target_files('.nii.gz'), *target_files('.vtk'),
+                config.saveFigDir / config.ocd_profile_file,
+                *[config.saveFigDir / f'{i}_OCD_response_tract_streams.csv' for i in config.coronal_slices_displayed_mm]],
+            requires=['generate_alic', 'split_racc'])]
+
+def centroid_step():
+    """
+    This function describes the centroid calculation step of the HCP pipelines.
+    """
+    return Step('generate_centroid', generate_centroid,
+        inputs=[*target_files('.nii.gz'), *config.alic_mask_files.values(), config.acpc_to_mni_xfm],
+        outputs=target_files('_centerofmass_withinALIC_mni.csv'),
+        requires=['subsegment_alic'])
+
+def transform_bundles_step():
+    """
+    This function describes the fiber bundle transformation step of the OCD pipeline.
+    """
+    return Step('transform_bundles', transform_bundles,
+        inputs=[*target_files('.vtk'), config.DTI_to_acpc_xfm],
+        outputs=target_files('_space-dti.vtk'),
+        requires=['subsegment_alic'])
+
+# caches shared by all subjects of a processed dataset
+def use_dataset_caches(alicpype_root):
+    """
+    This function places the transform and container image caches under the processed dataset root, unless they are
+    configured as absolute paths.
+    :alicpype_root:     path to processed dataset from ALIC_tractography pipeline
+    """
+    config.transform_cache_dir = Path(alicpype_root) / config.transform_cache_dir
+    config.container_cache_dir = Path(alicpype_root) / config.container_cache_dir
+
 def run_hcp_subject(subject, hcp_root, alicpype_root, selection=None ):
-    """ 
+    """
     This function runs through all subject-specific processing steps for 3T HCP data. The available steps (in order of execution) are:
     import_hcp_subject:     copy inputs from 3T HCP dataset
     generate_alic:          generate whole ALIC tractogram
     split_racc:             split rACC into dorsal and ventral components
     subsegment_alic:        anatomically-based segmentation of the ALIC
     generate_centroid:      calculate centroids from each segmented ALIC density map
+    Steps that completed in a previous run and whose inputs are unchanged are skipped.
 
     :subject:               subject ID
     :hcp_root:              path to HCP-style dataset
     :alicpype_root:         path to processed dataset from ALIC_tractography pipeline
+    :selection:             list of step names to run, together with the steps they require. Default runs every out-of-date step.
     """
 
     hcp_root = Path(hcp_root)
-
-    # copy and paste data into input folders (externalio.py)
     alicpype_root = Path(alicpype_root) #convert datatype to path
     subject = str(subject)
     cwd = alicpype_root / subject / 'OCD_pipeline'
-    import_hcp_subject(subject,hcp_root,cwd)
-
-    # generate whole ALIC tractography (tractography.py)
-    generate_alic(cwd)
-
-    # generate split rACC ROI (divideracc.py)
-    split_racc(cwd)
-
-    # subsegment ALIC based on PFC ROIs (subsegment.py)
-    subsegment_alic(cwd)
-
-    # calculate centroids of each subsegmented ALIC heatmap (centroids.py)
-    generate_centroid(cwd)
+    use_dataset_caches(alicpype_root)
+
+    steps = [
+        # copy and paste data into input folders (externalio.py)
+        import_step('import_hcp_subject', lambda cwd: import_hcp_subject(subject, hcp_root, cwd),
+            hcp_root / subject, hcp_subject_files()),
+        # generate whole ALIC tractography (tractography.py), split rACC ROI (splitracc.py)
+        # and subsegment ALIC based on PFC ROIs (subsegment.py)
+        *alic_steps('import_hcp_subject'),
+        # calculate centroids of each subsegmented ALIC heatmap (centroids.py)
+        centroid_step()]
+    run_steps(steps, cwd, selection)
 
 def run_7T_hcp_subject (subject, hcp_root, alicpype_root, selection=None):
-    """ 
+    """
     This function runs through all subject-specific processing steps for 7T HCP data. The available steps (in order of execution) are:
     import_7T_hcp_subject:      copy inputs from 7T HCP dataset
     generate_alic:              generate whole ALIC tractogram
     split_racc:                 split rACC into dorsal and ventral components
     subsegment_alic:            anatomically-based segmentation of the ALIC
     generate_centroid:          calculate centroids from each segmented ALIC density map
+    Steps that completed in a previous run and whose inputs are unchanged are skipped.
 
     :subject:                   subject ID
     :hcp_root:                  path to HCP-style dataset
     :alicpype_root:             path to processed dataset from ALIC_tractography pipeline
+    :selection:                 list of step names to run, together with the steps they require. Default runs every out-of-date step.
     """
     hcp_root = Path(hcp_root)
-
-    # copy and paste data into input folders (externalio.py)
     alicpype_root = Path(alicpype_root) #convert datatype to path
     subject = str(subject)
     cwd = alicpype_root / subject / 'OCD_pipeline'
-    import_7T_hcp_subject(subject,hcp_root,cwd)
-
-    # generate whole ALIC tractography (tractography.py)
-    generate_alic(cwd)
-
-    # generate split rACC ROI (divideracc.py)
-    split_racc(cwd)
+    use_dataset_caches(alicpype_root)
 
-    # subsegment ALIC based on PFC ROIs (subsegment.py)
-    subsegment_alic(cwd)
-
-    # calculate centroids from each segmented ALIC density map (centroids.py)
-    generate_centroid(cwd)
+    steps = [
+        # copy and paste data into input folders (externalio.py)
+        import_step('import_7T_hcp_subject', lambda cwd: import_7T_hcp_subject(subject, hcp_root, cwd),
+            hcp_root / subject, hcp_7T_subject_files(), extra_outputs=[config.bvalsPath]),
+        *alic_steps('import_7T_hcp_subject'),
+        # calculate centroids from each segmented ALIC density map (centroids.py)
+        centroid_step()]
+    run_steps(steps, cwd, selection)
 
 def run_ocd_subject (subject, input_data_root, alicpype_root, selection=None):
-    """ 
+    """
     This function runs through all subject-specific processing steps for 7T data from OCD patients. The available steps (in order of execution) are:
     import_ocd_subject:         copy inputs from 7T OCD dataset
     generate_alic:              generate whole ALIC tractogram
     split_racc:                 split rACC into dorsal and ventral components
     subsegment_alic:            anatomically-based segmentation of the ALIC
-    generate_centroid:          calculate centroids from each segmented ALIC density map
+    transform_bundles:          transform each segmented ALIC fiber bundle to DTI space
+    Steps that completed in a previous run and whose inputs are unchanged are skipped.
 
     :subject:                   subject ID
     :input_data_root:           path to OCD patient dataset
     :alicpype_root:             path to processed dataset from ALIC_tractography pipeline
+    :selection:                 list of step names to run, together with the steps they require. Default runs every out-of-date step.
     """
     input_data_root = Path(input_data_root)
-
-    # copy and paste data into input folders (externalio.py)
     alicpype_root = Path(alicpype_root) #convert datatype to path
     subject = str(subject)
     cwd = alicpype_root / subject / 'OCD_pipeline'
-    import_ocd_subject(subject,input_data_root,cwd)
-
-    # generate whole ALIC tractography (tractography.py)
-    generate_alic(cwd)
-
-    # generate split rACC ROI (divideracc.py)
-    split_racc(cwd)
-
-    # subsegment ALIC based on PFC ROIs (subsegment.py)
-    subsegment_alic(cwd)
-
-    # calculate centroids of each subsegmented ALIC heatmap (centroids.py)
-    # transform fiber bundle within slicer
-    transform_bundles(cwd)
+    use_dataset_caches(alicpype_root)
+
+    steps = [
+        # copy and paste data into input folders (externalio.py)
+        import_step('import_ocd_subject', lambda cwd: import_ocd_subject(subject, input_data_root, cwd),
+            ocd_subject_dir(subject, input_data_root), ocd_subject_files(subject),
+            extra_outputs=[config.bvalsPath, config.diffPath]),
+        *alic_steps('import_ocd_subject'),
+        # transform fiber bundle within slicer (centroids.py)
+        transform_bundles_step()]
+    run_steps(steps, cwd, selection)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import os
+import signal
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from alicpype import config
+from alicpype.batch import run_batch
+
+def fake_task(subject, input_root, alicpype_root):
+    if subject == 's1':
+        os.kill(os.getpid(), signal.SIGKILL)
+    if subject == 's2':
+        raise RuntimeError('failing subject')
+    (Path(alicpype_root) / subject).touch()
+
+class TestRunBatch(unittest.TestCase):
+    def test_killed_worker_only_fails_its_subject(self):
+        use_container_cache = config.use_container_cache
+        config.use_container_cache = False
+        try:
+            with TemporaryDirectory() as tmp:
+                subjects = [f's{i}' for i in range(6)]
+                failed = run_batch(fake_task, subjects, tmp, tmp, n_workers=2, threads=1)
+                finished = sorted(i.name for i in Path(tmp).iterdir() if i.name in subjects)
+        finally:
+            config.use_container_cache = use_container_cache
+        self.assertEqual(sorted(failed), ['s1', 's2'])
+        self.assertEqual(finished, ['s0', 's3', 's4', 's5'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from subprocess import run
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from alicpype import config
+from alicpype.containers import sif_path, localize_script, preflight, resolve_image, required_images
+
+class TestContainerCache(unittest.TestCase):
+    def test_localize_linked_script(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            sif = sif_path('docker://brainlife/mrtrix3:3.0.0', tmp)
+            sif.touch()
+            shared_main = tmp / 'shared_main'
+            shared_main.write_text('apptainer exec -e docker://brainlife/mrtrix3:3.0.0 tckgen ...\n')
+            os.chmod(shared_main, 0o755)
+            os.symlink(shared_main, tmp / 'main')
+            localize_script(tmp / 'main', tmp / 'main.local', tmp)
+            self.assertEqual((tmp / 'main.local').read_text(), f'apptainer exec -e {sif} tckgen ...\n')
+            self.assertTrue(os.access(tmp / 'main.local', os.X_OK))
+            self.assertTrue((tmp / 'main').is_symlink())
+            self.assertIn('docker://', shared_main.read_text())
+            self.assertEqual(preflight(['docker://brainlife/mrtrix3:3.0.0', 'docker://brainlife/fsl:6.0.0'], tmp),
+                ['docker://brainlife/fsl:6.0.0'])
+
+    def test_no_pull_when_disabled(self):
+        use_container_cache, container_pull_missing = config.use_container_cache, config.container_pull_missing
+        config.use_container_cache, config.container_pull_missing = True, False
+        try:
+            with TemporaryDirectory() as tmp:
+                with self.assertRaisesRegex(FileNotFoundError, 'brainlife/fsl:6.0.0.*alicpype.containers --pull'):
+                    resolve_image('docker://brainlife/fsl:6.0.0', tmp)
+        finally:
+            config.use_container_cache, config.container_pull_missing = use_container_cache, container_pull_missing
+
+    def test_required_images_of_pinned_version(self):
+        with TemporaryDirectory() as tmp:
+            git = lambda *args: run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                cwd=tmp, check=True, capture_output=True)
+            git('init')
+            (Path(tmp) / 'main').write_text('apptainer exec docker://brainlife/fsl:6.0.0 bet ...\n')
+            git('add', 'main')
+            git('commit', '-m', 'v1')
+            git('tag', 'v1')
+            (Path(tmp) / 'main').write_text('apptainer exec docker://brainlife/fsl:6.0.4 bet ...\n')
+            self.assertIn('docker://brainlife/fsl:6.0.0', required_images(tmp, 'v1'))
+            self.assertNotIn('docker://brainlife/fsl:6.0.0', required_images(tmp))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from alicpype.externalio import import_file, import_subject_from_list
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.source_dir = Path(self.tmp.name) / 'source' / 'sub-01'
+        self.cwd = Path(self.tmp.name) / 'cwd'
+        os.makedirs(self.source_dir / 'T1w')
+        (self.source_dir / 'T1w' / 'aparc+aseg.nii.gz').write_bytes(b'segmentation')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_strategies(self):
+        source_file = self.source_dir / 'T1w' / 'aparc+aseg.nii.gz'
+        os.makedirs(self.cwd)
+        for strategy in ['copy', 'hardlink', 'symlink', 'auto']:
+            with self.subTest(strategy=strategy):
+                import_file(source_file, self.cwd / 'seg.nii.gz', strategy)
+                self.assertEqual((self.cwd / 'seg.nii.gz').read_bytes(), b'segmentation')
+
+    def test_reimport_does_not_write_through_links(self):
+        source_file = self.source_dir / 'T1w' / 'aparc+aseg.nii.gz'
+        os.makedirs(self.cwd)
+        import_file(source_file, self.cwd / 'seg.nii.gz', 'hardlink')
+        import_file(source_file, self.cwd / 'seg.nii.gz', 'copy')
+        (self.cwd / 'seg.nii.gz').write_bytes(b'modified')
+        self.assertEqual(source_file.read_bytes(), b'segmentation')
+
+    def test_repeated_source_is_linked(self):
+        to_copy = {'segmentation': ['T1w/aparc+aseg.nii.gz', Path('indata/aparc+aseg.nii.gz')],
+            'segmentation_fs': ['T1w/aparc+aseg.nii.gz', Path('indata/fs/aparc+aseg.nii.gz')]}
+        import_subject_from_list(self.source_dir, self.cwd, to_copy, 'copy')
+        self.assertTrue(os.path.samefile(self.cwd / 'indata/aparc+aseg.nii.gz', self.cwd / 'indata/fs/aparc+aseg.nii.gz'))
+
+    def test_unchanged_sources_are_skipped(self):
+        to_copy = {'segmentation': ['T1w/aparc+aseg.nii.gz', Path('indata/aparc+aseg.nii.gz')]}
+        import_subject_from_list(self.source_dir, self.cwd, to_copy, 'copy')
+        dest_file = self.cwd / 'indata/aparc+aseg.nii.gz'
+        dest_file.write_bytes(b'kept')
+        import_subject_from_list(self.source_dir, self.cwd, to_copy, 'copy')
+        self.assertEqual(dest_file.read_bytes(), b'kept')
+        (self.source_dir / 'T1w' / 'aparc+aseg.nii.gz').write_bytes(b'new segmentation')
+        import_subject_from_list(self.source_dir, self.cwd, to_copy, 'copy')
+        self.assertEqual(dest_file.read_bytes(), b'new segmentation')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import unittest
+import tempfile
+from pathlib import Path
+import numpy as np
+import nibabel as nib
+import pandas as pd
+from scipy import ndimage
+from dipy.tracking.utils import density_map
+
+from alicpype.heatmap import rasterize_streamlines, density_from_rasterized, compact_dtype, save_density_volume
+from alicpype.heatmap import centerofmass_by_slice
+
+class TestHeatmap(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.affine = np.array([[-1.25, 0, 0, 90], [0, 1.25, 0, -126], [0, 0, 1.25, -72], [0, 0, 0, 1]])
+        self.shape = (145, 174, 145)
+        self.streams = nib.streamlines.ArraySequence(
+            [np.cumsum(rng.normal(0, 1, (rng.integers(1, 80), 3)), axis=0) for _ in range(1000)])
+        self.selection = rng.choice(len(self.streams), 100, replace=False)
+
+    def test_matches_dipy_density_map(self):
+        rasterized = rasterize_streamlines(self.streams, self.affine, self.shape, chunk_size=300)
+        np.testing.assert_array_equal(
+            density_from_rasterized(rasterized, self.shape),
+            density_map(self.streams, self.affine, self.shape))
+        np.testing.assert_array_equal(
+            density_from_rasterized(rasterized, self.shape, self.selection),
+            density_map(self.streams[self.selection], self.affine, self.shape))
+
+    def test_selection_of_empty_streamline(self):
+        streams = nib.streamlines.ArraySequence([np.zeros((2, 3)), np.zeros((0, 3))])
+        rasterized = rasterize_streamlines(streams, np.eye(4), (2, 2, 2))
+        self.assertEqual(rasterized[1].dtype, np.int32)
+        self.assertEqual(density_from_rasterized(rasterized, (2, 2, 2), [1]).sum(), 0)
+        self.assertEqual(density_from_rasterized(rasterized, (2, 2, 2), [0, 1])[0, 0, 0], 1)
+
+    def test_compact_dtype(self):
+        self.assertEqual(compact_dtype(255), np.uint8)
+        self.assertEqual(compact_dtype(256), np.uint16)
+
+    def test_centerofmass_matches_slice_loop(self):
+        rng = np.random.default_rng(1)
+        density = density_from_rasterized(rasterize_streamlines(self.streams, self.affine, self.shape), self.shape)
+        density += rng.poisson(2, self.shape)
+        mask = np.zeros(self.shape)
+        mask[40:90, 80:120, 50:95] = rng.random((50, 40, 45))
+        mask[mask < 0.3] = 0
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            density_file = Path(tmp_dir) / 'density.nii.gz'
+            save_density_volume(density, nib.Nifti1Image(np.zeros(self.shape), self.affine), density_file)
+            density_img = nib.load(density_file)
+            centerofmass = centerofmass_by_slice(density_img, mask)
+            # per-slice loop over the whole masked density map
+            in_img = density_img.get_fdata() * mask
+            expected = np.zeros([self.shape[1], 3])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                for iSlice in range(self.shape[1]):
+                    tmp = ndimage.center_of_mass(in_img[:, iSlice, :], labels=None, index=None)
+                    expected[iSlice, :] = [tmp[0], iSlice, tmp[1]]
+        rows = [pd.DataFrame(nib.affines.apply_affine(self.affine, c[~np.any(np.isnan(c), axis=1)])).to_csv(index=False)
+            for c in [centerofmass, expected]]
+        self.assertEqual(rows[0], rows[1])
+        self.assertEqual(rows[0].count('\n'), 41)
+
+if __name__ == '__main__':
+    unittest.main()
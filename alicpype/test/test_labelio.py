@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import numpy as np
+import nibabel as nib
+
+from alicpype.labelio import label_dtype, load_labels, load_mask, save_labels
+
+class TestLabelio(unittest.TestCase):
+    def test_label_dtype(self):
+        self.assertEqual(label_dtype(np.array([0, 255])), np.uint8)
+        self.assertEqual(label_dtype(np.array([0, 22026])), np.int16)
+        self.assertEqual(label_dtype(np.array([-1, 40000])), np.int32)
+
+    def test_round_trip(self):
+        ref = nib.Nifti1Image(np.zeros((4, 4, 4)), np.diag([-1.0, 1, 1, 1]))
+        labels = np.zeros((4, 4, 4), dtype=np.int32)
+        labels[1, 2, 3] = 22026
+        with TemporaryDirectory() as tmp:
+            save_labels(labels, ref, Path(tmp) / 'labels.nii.gz')
+            save_labels(labels > 0, ref, Path(tmp) / 'mask.nii.gz')
+            self.assertEqual(nib.load(Path(tmp) / 'labels.nii.gz').get_data_dtype(), np.int16)
+            self.assertEqual(nib.load(Path(tmp) / 'mask.nii.gz').get_data_dtype(), np.uint8)
+            loaded = load_labels(Path(tmp) / 'labels.nii.gz')
+            mask = load_mask(Path(tmp) / 'mask.nii.gz')
+        np.testing.assert_array_equal(loaded, labels)
+        self.assertEqual(loaded.dtype, np.int16)
+        np.testing.assert_array_equal(mask, labels > 0)
+
+if __name__ == '__main__':
+    unittest.main()
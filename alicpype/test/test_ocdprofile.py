@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import numpy as np
+import pandas as pd
+
+from alicpype.ocdprofile import profile_planes, save_ocd_profile, load_ocd_profile, save_slice_tables, slice_table
+
+class TestOcdProfile(unittest.TestCase):
+    def test_profile_planes(self):
+        np.testing.assert_array_equal(profile_planes(-2, 2, 1.5, include=[0]), [-2, -0.5, 0, 1])
+
+    def test_slice_tables(self):
+        with TemporaryDirectory() as tmp:
+            profile_file = Path(tmp) / 'profile.npz'
+            save_ocd_profile(profile_file, ['a', 'b'], [1, 3], [[1, 2], [0, 0]], [4, 0])
+            save_slice_tables(profile_file, tmp, [3])
+            with self.assertRaises(KeyError):
+                save_slice_tables(profile_file, tmp, [2])
+            table = pd.read_csv(Path(tmp) / '3_OCD_response_tract_streams.csv')
+        self.assertEqual(list(table.columns), ['target', 'number_of_streamlines', 'percent_streamlines'])
+        self.assertEqual(list(table['number_of_streamlines']), [2, 0])
+        self.assertEqual(table['percent_streamlines'][0], 50)
+        self.assertTrue(np.isnan(table['percent_streamlines'][1]))
+
+    def test_roi_counts(self):
+        with TemporaryDirectory() as tmp:
+            profile_file = Path(tmp) / 'profile.npz'
+            save_ocd_profile(profile_file, ['a', 'b'], [1, 3], [[1, 2], [0, 1]], [4, 2], [3], [[3], [1]])
+            profile = load_ocd_profile(profile_file)
+        # crossing counts are kept for every plane, the planar ROI counts are used for the table of their slice
+        np.testing.assert_array_equal(profile['counts'], [[1, 2], [0, 1]])
+        self.assertEqual(list(slice_table(profile, 3)['number_of_streamlines']), [3, 1])
+        self.assertEqual(list(slice_table(profile, 3)['percent_streamlines']), [75, 50])
+        self.assertEqual(list(slice_table(profile, 1)['number_of_streamlines']), [1, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+import unittest
+import numpy as np
+import nibabel as nib
+
+from alicpype.planecrossing import streams_crossing_planes
+
+class TestPlaneCrossing(unittest.TestCase):
+    def test_crossings_inside_roi(self):
+        affine = np.diag([-1.0, 1, 1, 1])
+        affine[0, 3] = 9
+        masks = np.zeros((2, 10, 10, 10), dtype=bool)
+        masks[0, 2:5, 3, 2:5] = True # plane y = 3, world x 5..7
+        masks[1, :, 6, :] = True # plane y = 6
+        streams = nib.streamlines.ArraySequence([
+            np.array([[6.0, 0, 3], [6, 2, 3], [6, 5, 3]]), # crosses y = 3 between points, inside the ROI
+            np.array([[1.0, 0, 3], [1, 7, 3]]), # crosses y = 3 outside the ROI and y = 6 in one segment
+            np.array([[6.0, 0, 3], [6, 2.9, 3]]), # stops before y = 3
+            np.array([[6.0, 3, 3]]), # single point on the plane
+        ])
+        hits = streams_crossing_planes(streams, [6, 3], masks[::-1], affine)
+        np.testing.assert_array_equal(hits, [[False, True, False, False], [True, False, False, False]])
+        # a single volume shared by all planes
+        np.testing.assert_array_equal(streams_crossing_planes(streams, [6, 3], masks.any(axis=0), affine), hits)
+
+if __name__ == '__main__':
+    unittest.main()
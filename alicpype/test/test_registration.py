@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import numpy as np
+import nibabel as nib
+from scipy import ndimage
+
+from alicpype.registration import load_fsl_warp, apply_fsl_warp, warp_streamlines
+from alicpype.registration import load_itk_displacement_field, apply_itk_displacement_field, transform_points_itk
+from alicpype.registration import read_itk_affine, transform_streamlines, resample_nearest
+from alicpype.registration import resample_nifti_affine
+
+class TestFslWarp(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_warp(self, affine, displacement):
+        field = np.zeros((20, 30, 20, 3), dtype=np.float32)
+        field[..., :] = displacement
+        warp_file = Path(self.tmp.name) / 'warp.nii.gz'
+        nib.save(nib.Nifti1Image(field, affine), warp_file)
+        ref = nib.Nifti1Image(np.zeros((20, 30, 20), dtype=np.float32), affine)
+        return load_fsl_warp(warp_file, ref)
+
+    def test_fsl_x_axis_points_left(self):
+        # FSL scaled-voxel coordinates increase towards the left for both storage orientations
+        for affine in [np.diag([-0.7, 0.7, 0.7, 1]), np.diag([0.7, 0.7, 0.7, 1])]:
+            with self.subTest(affine=affine):
+                warp = self.make_warp(affine, [2, 0, 1])
+                points = nib.affines.apply_affine(affine, np.random.default_rng(0).random((5, 3)) * 10)
+                np.testing.assert_allclose(apply_fsl_warp(points, warp) - points,
+                    np.tile([-2, 0, 1], (5, 1)), atol=1e-5)
+
+    def test_warp_streamlines_keeps_structure(self):
+        warp = self.make_warp(np.diag([-1, 1, 1, 1]), [0, 0, 0])
+        streams = nib.streamlines.ArraySequence([np.ones((2, 3)), np.full((3, 3), 2.0)])
+        warped = warp_streamlines(streams[[1]], warp)
+        self.assertEqual(len(warped), 1)
+        np.testing.assert_allclose(warped[0], np.full((3, 3), 2.0), atol=1e-5)
+
+class TestItkDisplacementField(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.affine = np.array([[-1.0, 0, 0, 10], [0, 1, 0, -15], [0, 0, 1, -10], [0, 0, 0, 1]])
+        self.xfm_file = Path(self.tmp.name) / 'xfm.nii.gz'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save_field(self, field):
+        nib.save(nib.Nifti1Image(field.astype(np.float32)[:, :, :, None, :], self.affine), self.xfm_file)
+
+    def test_lps_displacement_is_inverted_like_slicer(self):
+        field = np.zeros((20, 30, 20, 3))
+        field[..., :] = [1, 2, 3] # LPS
+        self.save_field(field)
+        points = np.random.default_rng(0).random((5, 3)) * 5
+        np.testing.assert_allclose(transform_points_itk(points, self.xfm_file), points - [-1, -2, 3], atol=1e-5)
+
+    def test_inverse_round_trip(self):
+        voxels = np.stack(np.meshgrid(*[np.arange(n) for n in (20, 30, 20)], indexing='ij'), axis=-1)
+        self.save_field(np.sin(voxels / 5.0))
+        xfm = load_itk_displacement_field(self.xfm_file)
+        points = nib.affines.apply_affine(self.affine, np.random.default_rng(1).random((50, 3)) * [15, 25, 15] + 2)
+        forward = apply_itk_displacement_field(points, xfm)
+        np.testing.assert_allclose(apply_itk_displacement_field(forward, xfm, inverse=True), points, atol=1e-3)
+
+class TestItkAffine(unittest.TestCase):
+    def test_read_itk_affine(self):
+        with TemporaryDirectory() as tmp:
+            xfm_file = Path(tmp) / 'xfm.txt'
+            xfm_file.write_text('#Insight Transform File V1.0\n#Transform 0\n'
+                'Transform: AffineTransform_double_3_3\n'
+                'Parameters: 0 -1 0 1 0 0 0 0 1 1 2 3\n'
+                'FixedParameters: 10 0 0\n')
+            affine = read_itk_affine(xfm_file)
+        # LPS: x -> R (x - c) + t + c
+        point_lps = np.array([1.0, 2.0, 3.0])
+        rotation = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+        expected_lps = rotation @ (point_lps - [10, 0, 0]) + [1, 2, 3] + [10, 0, 0]
+        flip = np.array([-1, -1, 1])
+        transformed = transform_streamlines([point_lps[None] * flip], affine)
+        np.testing.assert_allclose(transformed[0][0], expected_lps * flip, atol=1e-5)
+
+class TestResampleNearest(unittest.TestCase):
+    def test_upsample(self):
+        data = np.arange(1, 9, dtype=np.float32).reshape(2, 2, 2)
+        out = resample_nearest(data, np.diag([2.0, 2, 2, 1]), np.eye(4), (4, 4, 4))
+        nearest = [0, 1, 1] # voxel i of the output is closest to voxel floor(i / 2 + 0.5) of the input
+        np.testing.assert_array_equal(out[:3, :3, :3], data[nearest][:, nearest][:, :, nearest])
+        np.testing.assert_array_equal(out[3], 0)
+
+class TestResampleNiftiAffine(unittest.TestCase):
+    def test_matches_whole_series_resampling(self):
+        rng = np.random.default_rng(0)
+        affine = np.diag([1.5, 1.5, 1.5, 1])
+        ref_affine = np.diag([-1.0, 1, 1, 1])
+        ref_affine[0, 3] = 20
+        xfm = np.eye(4)
+        xfm[:3, 3] = [1, 2, -1]
+        data = rng.random((12, 14, 10, 5)).astype(np.float32)
+        with TemporaryDirectory() as tmp:
+            in_file, ref_file, out_file = [Path(tmp) / i for i in ['dwi.nii.gz', 'ref.nii.gz', 'out.nii.gz']]
+            nib.save(nib.Nifti1Image(data, affine), in_file)
+            nib.save(nib.Nifti1Image(np.zeros((16, 18, 14), np.float32), ref_affine), ref_file)
+            resample_nifti_affine(in_file, ref_file, out_file, xfm, chunk_size=2, n_workers=2)
+            out = nib.load(out_file)
+            resampled = out.get_fdata()
+        voxel_map = np.linalg.inv(affine) @ xfm @ ref_affine
+        for i in range(5):
+            np.testing.assert_allclose(resampled[..., i], ndimage.affine_transform(data[..., i], voxel_map[:3, :3],
+                voxel_map[:3, 3], output_shape=(16, 18, 14), order=1), atol=1e-5)
+        np.testing.assert_allclose(out.affine, ref_affine)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from alicpype.scheduler import Step, run_steps
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cwd = Path(self.tmp.name)
+        (self.cwd / 'source.txt').write_text('a')
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_steps(self, fail_second=False):
+        def first(cwd):
+            self.calls.append('first')
+            (cwd / 'first.txt').write_text((cwd / 'source.txt').read_text())
+        def second(cwd):
+            self.calls.append('second')
+            if fail_second:
+                raise RuntimeError('interrupted')
+            (cwd / 'second.txt').write_text((cwd / 'first.txt').read_text())
+        def third(cwd):
+            self.calls.append('third')
+        return [
+            Step('first', first, inputs=['source.txt'], outputs=['first.txt']),
+            Step('second', second, inputs=['first.txt'], outputs=['second.txt'], requires=['first']),
+            Step('third', third, requires=['first'])]
+
+    def test_skips_up_to_date_steps(self):
+        run_steps(self.make_steps(), self.cwd)
+        self.assertEqual(self.calls, ['first', 'second', 'third'])
+        self.calls.clear()
+        run_steps(self.make_steps(), self.cwd)
+        self.assertEqual(self.calls, [])
+
+    def test_resumes_at_first_incomplete_step(self):
+        with self.assertRaises(RuntimeError):
+            run_steps(self.make_steps(fail_second=True), self.cwd)
+        self.calls.clear()
+        run_steps(self.make_steps(), self.cwd)
+        self.assertEqual(self.calls, ['second', 'third'])
+
+    def test_changed_input_reruns_downstream(self):
+        run_steps(self.make_steps(), self.cwd, method='hash')
+        self.calls.clear()
+        (self.cwd / 'source.txt').write_text('b')
+        run_steps(self.make_steps(), self.cwd, method='hash')
+        self.assertEqual(self.calls, ['first', 'second'])
+
+    def test_selection_runs_ancestors_only_if_needed(self):
+        run_steps(self.make_steps(), self.cwd, selection=['second'])
+        self.assertEqual(self.calls, ['first', 'second'])
+        self.calls.clear()
+        run_steps(self.make_steps(), self.cwd, selection=['second'])
+        self.assertEqual(self.calls, ['second'])
+
+if __name__ == '__main__':
+    unittest.main()
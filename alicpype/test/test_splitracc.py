@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+import unittest
+import numpy as np
+
+from alicpype.splitracc import shrinkarr
+
+class TestShrinkarr(unittest.TestCase):
+    def test_support_of_mask(self):
+        arr = np.zeros((10, 12, 14))
+        arr[2:5, 3, 7:12] = 1
+        arr[6, 8, 9] = 1
+        self.assertEqual([list(map(int, r)) for r in shrinkarr(arr)], [[2, 6], [3, 8], [7, 11]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import numpy as np
+import nibabel as nib
+
+from alicpype.streamlineio import save_streamlines_npy, load_streamlines_npy
+from alicpype.streamlineio import save_trx, load_trx, streamline_point_index
+from alicpype.streamlineio import iter_tck_blocks, TckWriter, StreamsNpyWriter
+
+class TestStreamlinesNpy(unittest.TestCase):
+    def test_round_trip_is_memory_mapped(self):
+        rng = np.random.default_rng(0)
+        streams = nib.streamlines.ArraySequence([rng.random((n, 3)) for n in [1, 5, 3]])
+        with TemporaryDirectory() as tmp:
+            save_streamlines_npy(streams, Path(tmp) / 'oriented.streams')
+            loaded = load_streamlines_npy(Path(tmp) / 'oriented.streams')
+            self.assertIsInstance(loaded._data, np.memmap)
+            self.assertEqual(len(loaded), 3)
+            for expected, stream in zip(streams, loaded[[0, 1, 2]]):
+                np.testing.assert_allclose(stream, expected, rtol=1e-6)
+
+class TestTckBlocks(unittest.TestCase):
+    def test_blocks_match_nibabel(self):
+        rng = np.random.default_rng(0)
+        streams = nib.streamlines.ArraySequence([rng.random((n, 3)).astype(np.float32) for n in rng.integers(2, 20, 50)])
+        with TemporaryDirectory() as tmp:
+            in_file, out_file = Path(tmp) / 'in.tck', Path(tmp) / 'out.tck'
+            nib.streamlines.save(nib.streamlines.Tractogram(streams, affine_to_rasmm=np.eye(4)), in_file)
+            blocks = list(iter_tck_blocks(in_file, block_size=20, buffer_points=64))
+            self.assertEqual([len(i) for i in blocks], [20, 20, 10])
+            with TckWriter(out_file) as writer:
+                for block in blocks:
+                    writer.append(block)
+            loaded = nib.streamlines.load(out_file)
+        self.assertEqual(int(loaded.header['count']), 50)
+        for expected, stream in zip(streams, loaded.streamlines):
+            np.testing.assert_array_equal(stream, expected)
+
+    def test_blocks_to_npy_cache(self):
+        rng = np.random.default_rng(1)
+        streams = nib.streamlines.ArraySequence([rng.random((n, 3)).astype(np.float32) for n in rng.integers(0, 300, 40)])
+        with TemporaryDirectory() as tmp:
+            in_file, out_dir = Path(tmp) / 'in.tck', Path(tmp) / 'out.streams'
+            nib.streamlines.save(nib.streamlines.Tractogram(streams, affine_to_rasmm=np.eye(4)), in_file)
+            with StreamsNpyWriter(out_dir) as writer:
+                for block in iter_tck_blocks(in_file, block_size=7, buffer_points=50):
+                    writer.append(block)
+            loaded = load_streamlines_npy(out_dir, mmap_mode=None)
+            self.assertEqual(sorted(i.name for i in Path(tmp).iterdir()), ['in.tck', 'out.streams'])
+        self.assertEqual(len(loaded), 40)
+        for expected, stream in zip(streams, loaded):
+            np.testing.assert_array_equal(stream, expected)
+
+class TestTrx(unittest.TestCase):
+    def test_groups_and_data_per_point(self):
+        rng = np.random.default_rng(0)
+        streams = nib.streamlines.ArraySequence([rng.random((n, 3)) for n in [2, 4, 3]])
+        ref_img = nib.Nifti1Image(np.zeros((4, 5, 6), np.uint8), np.diag([2.0, 2, 2, 1]))
+        mni = np.full((9, 3), np.nan, np.float32)
+        mni[streamline_point_index(streams, [2, 0])] = np.concatenate([streams[2], streams[0]]) + 1
+        with TemporaryDirectory() as tmp:
+            trx_file = Path(tmp) / 'tracks.trx'
+            save_trx(streams, trx_file, ref_img, {'target': [2, 0]}, {'mni': mni})
+            group = load_trx(trx_file, group='target')
+            group_mni = load_trx(trx_file, group='target', data_per_point='mni')
+            self.assertEqual(len(group), 2)
+            np.testing.assert_allclose(group[0], streams[2], rtol=1e-6)
+            np.testing.assert_allclose(group_mni[1], streams[0] + 1, rtol=1e-6)
+            # one row per point, a flattened array is not reshaped into one
+            with self.assertRaises(ValueError):
+                save_trx(streams, trx_file, ref_img, data_per_point={'mni': mni.ravel()})
+
+if __name__ == '__main__':
+    unittest.main()
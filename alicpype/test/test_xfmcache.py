@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from alicpype.xfmcache import cached_transform, evict
+
+def convert_one(source_xfm, out_file, ref_image):
+    out_file.write_text('1')
+
+def convert_two(source_xfm, out_file, ref_image):
+    out_file.write_text('2')
+
+class TestTransformCache(unittest.TestCase):
+    def test_converter_is_part_of_the_key(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            (tmp / 'warp.nii.gz').write_text('warp')
+            (tmp / 'ref.nii.gz').write_text('ref')
+            outputs = [cached_transform(tmp / 'warp.nii.gz', tmp / 'ref.nii.gz', 'itk', tmp / f'{i}.nii.gz', convert,
+                tmp / 'cache').read_text() for i, convert in enumerate([convert_one, convert_two, convert_one])]
+        self.assertEqual(outputs, ['1', '2', '1'])
+
+    def test_evict_only_unlinked_entries(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            for i, name in enumerate(['linked.nii.gz', 'unlinked.nii.gz', 'new.nii.gz']):
+                (tmp / name).write_bytes(b'0' * 10)
+                os.utime(tmp / name, (i, i))
+            os.link(tmp / 'linked.nii.gz', tmp / 'subject.nii.gz')
+            evict(tmp, 15, keep=tmp / 'new.nii.gz')
+            self.assertEqual(sorted(i.name for i in tmp.iterdir()), ['linked.nii.gz', 'new.nii.gz', 'subject.nii.gz'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ from pathlib import Path
 from subprocess import run
 
 from . import config
+from .containers import localize_script
 
 def generate_alic(cwd):
     """ 
@@ -25,19 +26,79 @@ def generate_alic(cwd):
         else:
             warn('%s doesn''t exist!' % str(abs_file))
 
-    # git clone app-track_aLIC
-    run(['git', 'clone', str(config.ALIC_TRACTOGRAPHY_DIR/'app-track_aLIC'), str(cwd/'app-track_aLIC')], check=True)
+    # set up app-track_aLIC
+    env = {**os.environ, "APPTAINER_BIND": '/home'}
+    if config.alic_app_mode == 'shared':
+        setup_shared_alic_app(cwd/'app-track_aLIC', config.alic_app_dir, config.alic_app_version)
+        # the links into the shared install must resolve inside the containers
+        env["APPTAINER_BIND"] = f'/home,{Path(config.alic_app_dir).resolve()}'
+    else:
+        setup_cloned_alic_app(cwd/'app-track_aLIC', config.alic_app_dir, config.alic_app_version)
+
+    # run the containers of app-track_aLIC from the local image cache, with an untracked copy of main
+    main_script = './main'
+    if config.use_container_cache:
+        localize_script(cwd/'app-track_aLIC'/'main', cwd/'app-track_aLIC'/'main.local')
+        main_script = './main.local'
+
+    # run "main" app-track_aLIC script (command to run, environment, select cwd)
+    run( main_script, env=env, cwd=cwd/'app-track_aLIC')
+
+# commit of an app-track_aLIC checkout
+def alic_app_commit(app_dir, version='HEAD'):
+    """ 
+    This function returns the full git commit hash of a version of an app-track_aLIC checkout.
+    :app_dir:   app-track_aLIC checkout
+    :version:   any git revision (commit, short hash, tag or branch), default the checked out commit
+    """
+    p = run(['git', 'rev-parse', '--verify', f'{version}^{{commit}}'], cwd=app_dir, check=True, capture_output=True, text=True)
+    return p.stdout.strip()
+
+# per-subject git clone of app-track_aLIC
+def setup_cloned_alic_app(work_dir, app_dir, version=None):
+    """ 
+    This function clones app-track_aLIC (with its submodules) into a subject's directory.
+    :work_dir:  subject-specific app-track_aLIC directory
+    :app_dir:   app-track_aLIC repository to clone
+    :version:   git commit to check out, None for the cloned HEAD
+    """
+    # git clone app-track_aLIC (already present when resuming an interrupted run)
+    if not work_dir.is_dir():
+        run(['git', 'clone', str(app_dir), str(work_dir)], check=True)
+    if version is not None:
+        run(['git', 'checkout', version], cwd=work_dir, check=True)
 
     # git submodule update
-    run(['git', 'submodule', 'update', '--init', '--recursive'], cwd=cwd/'app-track_aLIC', check=True)
+    run(['git', 'submodule', 'update', '--init', '--recursive'], cwd=work_dir, check=True)
 
     # link indata to app-track_aLIC/indata
     try:
-        os.symlink('../indata' , cwd/'app-track_aLIC/indata')
+        os.symlink('../indata' , work_dir/'indata')
     except FileExistsError:
         # if app-track_aLic/indata already exists, ignore the error
         pass
 
-    # run "main" app-track_aLIC script (command to run, environment, select cwd)
-    env = {**os.environ, "APPTAINER_BIND": '/home'}
-    run( './main', env=env, cwd=cwd/'app-track_aLIC')
+# per-subject working directory backed by a shared app-track_aLIC install
+def setup_shared_alic_app(work_dir, app_dir, version=None):
+    """ 
+    This function creates a lightweight app-track_aLIC working directory for a subject. Every top-level entry of
+    the shared install is linked into it, except indata (linked to the subject's indata) and output (created
+    in the working directory), so the cost per subject doesn't depend on the size of the install.
+    :work_dir:  subject-specific app-track_aLIC working directory
+    :app_dir:   shared app-track_aLIC install (with submodules initialized)
+    :version:   git revision (commit, short hash or tag) the shared install must be at, None to skip the check
+    """
+    app_dir = Path(app_dir).resolve()
+    if not (app_dir/'main').is_file():
+        raise FileNotFoundError(f'{app_dir} is not an app-track_aLIC install')
+    if version is not None and alic_app_commit(app_dir) != alic_app_commit(app_dir, version):
+        raise RuntimeError(f'{app_dir} is at commit {alic_app_commit(app_dir)}, expected {version} '
+            f'({alic_app_commit(app_dir, version)})')
+
+    os.makedirs(work_dir/'output', exist_ok=True)
+    if not os.path.lexists(work_dir/'indata'):
+        os.symlink('../indata', work_dir/'indata')
+    for entry in app_dir.iterdir():
+        if entry.name in ['indata', 'output', '.git'] or os.path.lexists(work_dir/entry.name):
+            continue
+        os.symlink(entry, work_dir/entry.name)
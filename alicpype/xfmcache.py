@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# description: content-addressed cache of converted transforms, shared by all subjects, steps and reruns
+
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from tempfile import mkstemp
+
+from . import config
+
+DIGEST_INDEX = 'digests.json'
+
+# part of every cache key, bump whenever a conversion function changes its output so that stale entries are not served
+CONVERTER_VERSION = 2
+
+def _suffix(path):
+    """
+    This function returns the full suffix of a file name (ex. '.nii.gz').
+    """
+    return ''.join(Path(path).suffixes)
+
+# sha256 of a file, memoized by path, size and modification time
+def file_digest(path, cache_dir=None):
+    """
+    This function returns the sha256 of a file. Digests are remembered in the cache directory so that unchanged
+    multi-GB warps are only read once.
+    :path:          file to hash
+    :cache_dir:     transform cache directory, default config.transform_cache_dir
+    """
+    cache_dir = Path(config.transform_cache_dir if cache_dir is None else cache_dir)
+    path = Path(path).resolve()
+    stat = path.stat()
+    index_file = Path(cache_dir) / DIGEST_INDEX
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+    entry = index.get(str(path))
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            sha.update(chunk)
+    index[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha.hexdigest()}
+    # replace the index atomically, concurrent workers at worst lose each other's entries
+    fd, tmp_file = mkstemp(dir=cache_dir, suffix='.json.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+    return sha.hexdigest()
+
+def cache_key(source_xfm, ref_image, target_format, convert, cache_dir=None):
+    """
+    This function returns the cache key of a converted transform.
+    :source_xfm:        transform to convert
+    :ref_image:         reference image of the conversion
+    :target_format:     name of the output format (ex. 'mrtrix', 'itk')
+    :convert:           conversion function (its name and CONVERTER_VERSION are part of the key)
+    :cache_dir:         transform cache directory, default config.transform_cache_dir
+    """
+    converter = f'{convert.__module__}.{convert.__qualname__}@{CONVERTER_VERSION}'
+    key = ':'.join([file_digest(source_xfm, cache_dir), file_digest(ref_image, cache_dir), target_format, converter])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def evict(cache_dir=None, max_bytes=None, keep=None):
+    """
+    This function removes the least recently used converted transforms until the cache fits its size budget.
+    Transforms still hardlinked from a subject directory are neither counted nor evicted, removing them would not
+    free their disk space.
+    :cache_dir:     transform cache directory, default config.transform_cache_dir
+    :max_bytes:     size budget of the cache, default config.transform_cache_max_gb
+    :keep:          entry that must not be evicted (ex. the one being used)
+    """
+    cache_dir = config.transform_cache_dir if cache_dir is None else cache_dir
+    max_bytes = config.transform_cache_max_gb * 1024**3 if max_bytes is None else max_bytes
+    entries = [(i, i.stat()) for i in Path(cache_dir).iterdir()
+        if i.is_file() and i.name != DIGEST_INDEX and '.tmp' not in i.name and i != keep]
+    entries = sorted([(i, stat) for i, stat in entries if stat.st_nlink == 1], key=lambda i: i[1].st_mtime)
+    total = sum(stat.st_size for i, stat in entries)
+    if keep is not None and Path(keep).is_file() and Path(keep).stat().st_nlink == 1:
+        total += Path(keep).stat().st_size
+    for entry, stat in entries:
+        if total <= max_bytes:
+            break
+        print(f'evicting {entry} from transform cache')
+        total -= stat.st_size
+        entry.unlink(missing_ok=True)
+
+def _place(entry, out_file):
+    """
+    This function makes a cached transform available at out_file, as a hardlink when possible.
+    """
+    out_file = Path(out_file)
+    os.makedirs(out_file.parent, exist_ok=True)
+    out_file.unlink(missing_ok=True)
+    try:
+        os.link(entry, out_file)
+    except OSError:
+        shutil.copyfile(entry, out_file)
+
+def cached_transform(source_xfm, ref_image, target_format, out_file, convert,
+        cache_dir=None, max_bytes=None):
+    """
+    This function fetches a converted transform from the cache, converting and storing it on a miss.
+    Cached files are read-only and hardlinked to out_file, so they must not be modified in place. A linked transform
+    takes disk space once for the cache and all the subjects linking it.
+    :source_xfm:        transform to convert
+    :ref_image:         reference image of the conversion
+    :target_format:     name of the output format (ex. 'mrtrix', 'itk')
+    :out_file:          where the converted transform is needed
+    :convert:           conversion function called as convert(source_xfm, output_xfm, ref_image)
+    :cache_dir:         transform cache directory, default config.transform_cache_dir
+    :max_bytes:         size budget of the cache, default config.transform_cache_max_gb
+    """
+    cache_dir = Path(config.transform_cache_dir if cache_dir is None else cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = cache_dir / (cache_key(source_xfm, ref_image, target_format, convert, cache_dir) + _suffix(out_file))
+    if entry.is_file():
+        print(f'using cached {target_format} transform {entry}')
+        os.utime(entry) # mark as recently used
+    else:
+        print(f'converting {source_xfm} to {target_format} format')
+        # reserve a unique name, the conversion tools expect to create the output themselves
+        fd, tmp_file = mkstemp(dir=cache_dir, suffix='.tmp' + _suffix(out_file))
+        os.close(fd)
+        tmp_file = Path(tmp_file)
+        tmp_file.unlink()
+        try:
+            convert(Path(source_xfm), tmp_file, Path(ref_image))
+            os.chmod(tmp_file, 0o444)
+            os.replace(tmp_file, entry)
+        finally:
+            tmp_file.unlink(missing_ok=True)
+        evict(cache_dir, max_bytes, keep=entry)
+    _place(entry, out_file)
+    return Path(out_file)
+
+def convert_transform(source_xfm, out_file, ref_image, target_format, convert):
+    """
+    This function converts a transform, going through the transform cache when config.use_transform_cache is set.
+    :source_xfm:        transform to convert
+    :out_file:          output converted transform
+    :ref_image:         reference image of the conversion
+    :target_format:     name of the output format (ex. 'mrtrix', 'itk')
+    :convert:           conversion function called as convert(source_xfm, output_xfm, ref_image)
+    """
+    if config.use_transform_cache:
+        return cached_transform(source_xfm, ref_image, target_format, out_file, convert)
+    # out_file may be a read-only link into the cache from an earlier run
+    Path(out_file).unlink(missing_ok=True)
+    convert(Path(source_xfm), Path(out_file), Path(ref_image))
+    return Path(out_file)
@@ -4,9 +4,6 @@
 
 import alicpype as alic
 from pathlib import Path
-import sys 
-import numpy as np
-from traceback import print_exc
 
 TEST_ALIC_DIR = '/home/udall-raid7/HCP_data/Data_Processing/7T_HCP'
 TEST_HCP_DIR = '/home/udall-raid7/HCP_data/Data/3T_HCP_visit1'
@@ -14,22 +11,15 @@ TEST_HCP_DIR = '/home/udall-raid7/HCP_data/Data/3T_HCP_visit1'
 def main():
     """
     Run OCD pipeline on a CSV-formatted list of subjects. Syntax is 
-        main_batch_subjects.py subject_list.csv
+        main_batch_7T_subjects.py subject_list.csv [-j N_WORKERS] [--threads N_THREADS] [--memory-gb GB]
     """
-    subject_list_file = Path(sys.argv[1]).expanduser().resolve()
-    subject_list = np.loadtxt(subject_list_file, delimiter=',', dtype=str)
+    args = alic.batch.parse_args('run ALIC_tractography pipeline for a batch of subjects with 7T dMRI')
+    subject_list = alic.batch.load_subject_list(args.subject_list)
     print(subject_list)
 
-    # call alicpype tasks run_subject on each subject in list
-    for subject_id in subject_list:
-        print(f'starting processing for subject {subject_id}')
-        #skip subject if error out
-        try:
-            alic.tasks.run_7T_hcp_subject(
-                subject_id, TEST_HCP_DIR, TEST_ALIC_DIR)
-        except Exception as e:
-            print(f'encountered an error when running {subject_id}')
-            print_exc()
+    # call alicpype tasks run_7T_hcp_subject on each subject in list, skipping subjects that error out
+    alic.batch.run_batch(alic.tasks.run_7T_hcp_subject, subject_list, TEST_HCP_DIR, TEST_ALIC_DIR,
+        n_workers=args.workers, threads=args.threads, memory_gb=args.memory_gb, log_dir=args.log_dir)
 
 if __name__ == '__main__':
     main()
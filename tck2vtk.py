@@ -4,28 +4,22 @@ For each agrument, attempt to convert to vtk with the same base name
 """
 
 import sys
-from subprocess import check_call
 from warnings import warn
 from pathlib import Path
 
+from alicpype.streamlineio import tck_to_vtk
+
 OVERWRITE = False
+BINARY = False
 
 def tck2vtk(in_file):
     in_file = Path(in_file)
     assert(in_file.is_file())
     assert(in_file.suffix.lower() == '.tck')
-    
-    out_file = in_file.with_suffix('.vtk')
 
-    # make sure to set $APPTAINER_BIND before running. for instance:
-    # export APPTAINER_BIND=/home,${APPTAINER_BIND}
-    cmd = ['apptainer', 'exec', 'docker://brainlife/mrtrix3:3.0.0',
-		'tckconvert', str(in_file), str(out_file)]
-
-    if OVERWRITE:
-        cmd.append('-f')
-    print(cmd)
-    check_call(cmd)
+    out_file = in_file.with_suffix('.vtk')
+    print(f'converting {in_file} to {out_file}')
+    tck_to_vtk(in_file, out_file, binary=BINARY, overwrite=OVERWRITE)
 
 def main():
     # parse args